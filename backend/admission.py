@@ -0,0 +1,144 @@
+# admission.py
+import asyncio
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from functools import wraps
+
+import logging_manager
+import metrics
+
+
+class AdmissionRejected(Exception):
+    """The wait queue is full (or the wait took too long); the client should retry later."""
+
+    def __init__(self, retry_after: int, reason: str = "Server busy"):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """
+    Caps how many threads use a backend (mongo commands) at once. LLM calls are capped
+    inside llm_scheduler instead, where the limit respects the continuation priority.
+    Callers beyond the limit block until a slot frees up; the number of waiters
+    and the time spent waiting are exported as metrics under limiter.<name>.
+    """
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._waiting = 0
+
+    @contextmanager
+    def slot(self):
+        started = time.perf_counter()
+        with self._lock:
+            self._waiting += 1
+            metrics.set_gauge(f"limiter.{self.name}.waiting", self._waiting)
+        try:
+            self._semaphore.acquire()
+        finally:
+            with self._lock:
+                self._waiting -= 1
+                metrics.set_gauge(f"limiter.{self.name}.waiting", self._waiting)
+        metrics.observe(f"limiter.{self.name}.wait", time.perf_counter() - started)
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+    def wrap(self, func):
+        """Returns `func` wrapped so that every call holds a slot of this limiter."""
+        @wraps(func)
+        def limited(*args, **kwargs):
+            with self.slot():
+                return func(*args, **kwargs)
+        return limited
+
+
+class AdmissionController:
+    """
+    Admission layer for /chat:
+      - per-session FIFO: requests of the same session run one at a time, in arrival
+        order (asyncio.Lock wakes waiters in FIFO order), so they never interleave on
+        the same agent history;
+      - at most `max_active` requests run at once across all sessions;
+      - at most `max_queue` requests may be waiting; beyond that (or after waiting
+        `max_wait` seconds) the request is rejected with AdmissionRejected so the API
+        can answer 429 with a Retry-After estimate instead of piling up.
+    """
+
+    def __init__(self, max_active: int, max_queue: int, max_wait: float):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._active = asyncio.Semaphore(max_active)
+        self._session_locks = {} # session_id -> [asyncio.Lock, number of requests holding or waiting]
+        self._waiting = 0
+        self._service_time = 1.0 # Moving average of request duration, used for Retry-After
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self._service_time * (self._waiting + 1) / self.max_active))
+
+    def _set_depth(self, delta: int):
+        self._waiting += delta
+        metrics.set_gauge("admission.queue_depth", self._waiting)
+
+    @asynccontextmanager
+    async def admit(self, session_id: str):
+        entry = self._session_locks.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        queued_at = time.perf_counter()
+        try:
+            if not entry[0].locked() and not self._active.locked():
+                # Fast path: nothing to wait for, so the request never counts as queued
+                await self._acquire(entry[0])
+            else:
+                if self._waiting >= self.max_queue:
+                    metrics.increment("admission.rejected")
+                    logging_manager.log_debug("Admission", f"Queue full ({self._waiting}), rejecting request for session {session_id}")
+                    raise AdmissionRejected(self._retry_after())
+                self._set_depth(+1)
+                try:
+                    await asyncio.wait_for(self._acquire(entry[0]), timeout=self.max_wait)
+                except asyncio.TimeoutError:
+                    metrics.increment("admission.timed_out")
+                    raise AdmissionRejected(self._retry_after(), "Timed out waiting for a free slot")
+                finally:
+                    self._set_depth(-1)
+
+            metrics.observe("admission.wait", time.perf_counter() - queued_at)
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                self._active.release()
+                entry[0].release()
+                self._service_time = 0.8 * self._service_time + 0.2 * (time.perf_counter() - started)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._session_locks.pop(session_id, None)
+
+    async def _acquire(self, session_lock: asyncio.Lock):
+        """Takes the session turn first, then a global slot (releasing the turn if cancelled meanwhile)."""
+        await session_lock.acquire()
+        try:
+            await self._active.acquire()
+        except BaseException:
+            session_lock.release()
+            raise
+
+
+# --- Shared limits (configurable through the environment) ---
+mongo_limiter = ConcurrencyLimiter("mongo", int(os.getenv("MONGO_MAX_CONCURRENCY", "4")))
+chat_admission = AdmissionController(
+    max_active=int(os.getenv("CHAT_MAX_ACTIVE", "8")),
+    max_queue=int(os.getenv("CHAT_MAX_QUEUE", "32")),
+    max_wait=float(os.getenv("CHAT_MAX_WAIT", "60")),
+)
@@ -0,0 +1,287 @@
+# agent.py
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import communication
+import executor
+import llm_scheduler
+import logging_manager
+import metrics
+import model_router
+import result_compaction
+
+MAX_ITERATIONS = 10
+
+# Salidas de mongosh que indican que el comando falló: el siguiente paso va por la ruta de reintento
+_MONGO_ERROR_MARKERS = ("Error:", "MongoServerError", "SyntaxError", "ReferenceError", "TypeError")
+
+# Plantilla del prompt del agente (compartida por main.py y api_server.py).
+# Se mantiene con las llaves escapadas ({{ }}) y los marcadores {history}/{input}
+# del formato de PromptTemplate; se trocea una sola vez al importar el módulo.
+TEMPLATE = """Eres el agente Gemini-2.0-flash-001, un asistente experto en MongoDB. Interactúas con MongoDB usando la función `execute_mongo_command`.
+
+**Características Clave:**
+
+1.  **Mantenimiento de Contexto:** ¡Importante! El sistema **recuerda** la base de datos seleccionada con `use` entre comandos (cada conversación tiene la suya). Para trabajar en otra base de datos no necesitas un paso aparte: pon `use <nombre_db>;` delante del comando, en la misma respuesta (p. ej. `consulta mongo: use productos; db.inventario.find()`); la base de datos queda seleccionada para los comandos siguientes. Analiza el 'Historial de la conversación' para saber en qué base de datos estás.
+2.  **Comandos Soportados:** Puedes usar la mayoría de comandos estándar de `mongosh`:
+    *   Selección de BD: `use <nombre_db>`
+    *   Información: `db.getName()`, `show dbs`, `show collections`, `db.getCollectionNames()`
+    *   Operaciones CRUD: `db.<col>.insertOne({{ ... }})`, `db.<col>.insertMany([{{...}}, {{...}}])`, `db.<col>.find({{ ... }})`, `db.<col>.updateOne({{ ... }}, {{ ... }})`, `db.<col>.deleteOne({{ ... }})`, `db.<col>.countDocuments({{ ... }})` (Nota: Llaves para JSON deben escaparse como `{{` y `}}`).
+    *   Otros: `print('...')`, `db.runCommand({{ ... }})`
+3.  **Ejecución Secuencial:** Para tareas que requieren múltiples pasos (ej. cambiar de DB y luego buscar), envía **un comando por cada respuesta**. No intentes encadenar comandos con punto y coma (`;`) en una sola respuesta; la única excepción es el prefijo `use <nombre_db>;`.
+4.  **Resultados en Tabla:** Cuando un resultado contiene varios documentos con los mismos campos, la `respuesta mongo:` llega compactada: una primera línea con el número de documentos y los nombres de los campos (los subdocumentos aplanados como `campo.subcampo`), y después una fila por documento con los valores en ese mismo orden separados por ` | ` (vacío si el documento no tiene ese campo).
+
+**Flujo de Trabajo Autónomo:**
+
+1.  Recibirás una 'Entrada del usuario' inicial. Analízala junto con el 'Historial de la conversación'.
+2.  Determina el primer comando `mongosh` necesario para la tarea.
+3.  Genera tu respuesta como `consulta mongo: <comando>`.
+4.  **IMPORTANTE:** El sistema ejecutará tu comando y te devolverá **inmediatamente** el resultado como una nueva entrada en el historial con la etiqueta `respuesta mongo: <resultado>`.
+5.  **ITERACIÓN:** Analiza esta `respuesta mongo:` y el estado actual de la tarea.
+    *   Si se necesitan más pasos (ej. ejecutar la consulta principal después de un `use`, o realizar otra acción), genera la siguiente `consulta mongo: <siguiente_comando>`. El sistema volverá a ejecutarlo y te dará el resultado.
+    *   Repite este proceso, generando `consulta mongo:` para cada paso necesario.
+6.  **FINALIZACIÓN:** Cuando hayas completado **todos** los pasos necesarios para satisfacer la petición original del usuario, genera tu respuesta final como `respuesta usuario: <mensaje_final_al_usuario>`. Esto detendrá el ciclo de iteración para esa petición.
+7.  **SEGURIDAD:** Si necesitas ejecutar un comando peligroso (ej. `dropDatabase`, `drop`, `delete`), **antes** de generar la `consulta mongo:` para ese comando, genera `respuesta usuario: ¿Estás seguro de que quieres ejecutar [comando peligroso]?`. El sistema gestionará la confirmación del usuario; si es positiva, recibirás una indicación para proceder, momento en el cual generarás la `consulta mongo:` peligrosa. Si es negativa, genera una `respuesta usuario:` informando que se canceló.
+8.  **FORMATO:** Tu respuesta DEBE empezar SIEMPRE con `consulta mongo:` o `respuesta usuario:`, seguido de dos puntos y un espacio.
+
+**Ejemplos de Secuencia Autónoma:**
+
+*   *Usuario: "En la base de datos 'productos', busca los artículos con precio menor a 50 en la colección 'inventario' y dime cuántos hay."*
+    *   *Tu Respuesta 1:* `consulta mongo: use productos; db.inventario.find({{ price: {{ $lt: 50 }} }})`
+    *   *(Sistema añade al historial: respuesta mongo: [resultado de la búsqueda])*
+    *   *Tu Respuesta 2:* `consulta mongo: db.inventario.countDocuments({{ price: {{ $lt: 50 }} }})`
+    *   *(Sistema añade al historial: respuesta mongo: 5)*
+    *   *Tu Respuesta 3:* `respuesta usuario: Encontré 5 artículos con precio menor a 50 en la colección 'inventario' de la base de datos 'productos'. Los resultados de la búsqueda se mostraron previamente.`
+
+*   *Usuario: "Muéstrame todas las bases de datos."*
+    *   *Tu Respuesta 1:* `consulta mongo: show dbs`
+    *   *(Sistema añade al historial: respuesta mongo: admin 0.000GB ... local 0.000GB)*
+    *   *Tu Respuesta 2:* `respuesta usuario: Las bases de datos disponibles son admin, local, ...`
+
+*   *Usuario: "Elimina la colección 'logs_viejos' de la base de datos 'auditoria'."*
+    *   *Tu Respuesta 1:* `respuesta usuario: ¿Estás seguro de que quieres ejecutar db.logs_viejos.drop()?`
+    *   *(Usuario confirma)*
+    *   *(Sistema añade al historial: respuesta usuario: Confirmación recibida para db.logs_viejos.drop())* # O similar
+    *   *Tu Respuesta 2:* `consulta mongo: use auditoria; db.logs_viejos.drop()`
+    *   *(Sistema añade al historial: respuesta mongo: true)*
+    *   *Tu Respuesta 3:* `respuesta usuario: La colección 'logs_viejos' ha sido eliminada de la base de datos 'auditoria'.`
+
+Historial de la conversación:
+{history}
+
+Entrada del usuario: {input}
+Tu respuesta (con etiqueta):"""
+
+def _split_template(template: str):
+    """
+    Divide la plantilla en (cabecera, intermedio, final) alrededor de {history} y {input}
+    y resuelve las llaves escapadas. Así cada iteración solo concatena trozos ya hechos
+    en lugar de volver a formatear la plantilla completa.
+    """
+    head, rest = template.split("{history}")
+    middle, tail = rest.split("{input}")
+    unescape = lambda part: part.replace("{{", "{").replace("}}", "}")
+    return unescape(head), unescape(middle), unescape(tail)
+
+
+# Con GeminiLLM en modo JSON (GEMINI_RESPONSE_MODE=json, el valor por defecto) el modelo
+# responde con un objeto según communication.RESPONSE_SCHEMA: cambian la instrucción de
+# formato y la última línea. El historial y los ejemplos siguen en la forma 'etiqueta: contenido'.
+_TEXT_FORMAT = "8.  **FORMATO:** Tu respuesta DEBE empezar SIEMPRE con `consulta mongo:` o `respuesta usuario:`, seguido de dos puntos y un espacio."
+_JSON_FORMAT = """8.  **FORMATO:** Tu respuesta DEBE ser SIEMPRE un único objeto JSON, sin texto alrededor:
+    *   Para ejecutar un comando: `{{"action": "consulta mongo", "command": "<comando>", "database": "<nombre_db>"}}`. `database` es opcional: indícalo para trabajar en otra base de datos en lugar del prefijo `use <nombre_db>;` (queda seleccionada para los comandos siguientes).
+    *   Para responder al usuario: `{{"action": "respuesta usuario", "message": "<mensaje>"}}`.
+    *   El historial y los ejemplos muestran cada paso como `consulta mongo: ...` / `respuesta usuario: ...`; es solo la forma de registrarlos, tú responde en JSON."""
+_TEXT_ANSWER = "Tu respuesta (con etiqueta):"
+_JSON_ANSWER = "Tu respuesta (objeto JSON):"
+
+JSON_TEMPLATE = TEMPLATE.replace(_TEXT_FORMAT, _JSON_FORMAT).replace(_TEXT_ANSWER, _JSON_ANSWER)
+
+# Trozos del prompt por modo de respuesta del LLM ("text" o "json")
+_PROMPT_PARTS = {"text": _split_template(TEMPLATE), "json": _split_template(JSON_TEMPLATE)}
+
+
+class TurnBuffer:
+    """
+    Historial de la conversación, solo de adición. Cada turno se formatea una única vez
+    al añadirse (con los mismos prefijos que usaba ConversationBufferMemory), de modo que
+    construir el prompt no depende de volver a recorrer ni formatear los mensajes previos.
+    """
+
+    def __init__(self, human_prefix: str = "consulta usuario", ai_prefix: str = "respuesta modelo", response_mode: str = "text"):
+        self.human_prefix = human_prefix
+        self.ai_prefix = ai_prefix
+        self._head, self._middle, self._tail = _PROMPT_PARTS[response_mode]
+        self._parts = []
+
+    def __len__(self) -> int:
+        return len(self._parts)
+
+    def append(self, input_text: str, output_text: str):
+        """Añade un turno (entrada -> respuesta del modelo) al historial."""
+        separator = "\n" if self._parts else ""
+        self._parts.append(f"{separator}{self.human_prefix}: {input_text}\n{self.ai_prefix}: {output_text}")
+
+    @property
+    def history(self) -> str:
+        """Historial completo como texto."""
+        return "".join(self._parts)
+
+    def render(self, current_input: str) -> str:
+        """Construye el prompt completo para la entrada actual."""
+        return "".join((self._head, *self._parts, self._middle, current_input, self._tail))
+
+
+@dataclass
+class AgentResult:
+    """Resultado de procesar una petición del usuario."""
+    status: str # "completed", "confirmation_required", "cancelled" o "error"
+    response: Optional[str] = None # Respuesta final o mensaje de error/información
+    command_to_confirm: Optional[str] = None # Comando peligroso pendiente de confirmación
+    iterations: int = 0
+
+
+class AgentEngine:
+    """
+    Bucle autónomo del agente: pide al LLM el siguiente paso, ejecuta los comandos
+    `consulta mongo` y le devuelve el resultado hasta obtener una `respuesta usuario`.
+
+    Los backends son intercambiables:
+      - llm: función prompt -> texto del modelo (p. ej. GeminiLLM().complete).
+      - execute: función comando -> salida de mongosh (por defecto executor.execute_mongo_command,
+        en el contexto de base de datos de la sesión por defecto).
+      - compact: función salida -> texto para el prompt (por defecto result_compaction.compact_result;
+        `lambda output: output` para devolver los resultados tal cual).
+    `response_mode` es el formato en que responde el LLM ("text" o "json", el de
+    GeminiLLM.response_mode) y elige las instrucciones de formato del prompt.
+    """
+
+    def __init__(
+        self,
+        llm: Callable[[str], str],
+        execute: Callable[[str], str] = executor.execute_mongo_command,
+        is_dangerous: Callable[[str], bool] = executor.is_command_dangerous,
+        compact: Callable[[str], str] = result_compaction.compact_result,
+        max_iterations: int = MAX_ITERATIONS,
+        log_label: str = "Agent",
+        response_mode: str = "text",
+    ):
+        self.llm = llm
+        self.execute = execute
+        self.is_dangerous = is_dangerous
+        self.compact = compact
+        self.max_iterations = max_iterations
+        self.log_label = log_label
+        self.turns = TurnBuffer(response_mode=response_mode)
+
+    def run(
+        self,
+        user_input: str,
+        authorize: Optional[Callable[[str], bool]] = None,
+        on_mongo_response: Optional[Callable[[str], None]] = None,
+        priority: int = llm_scheduler.PRIORITY_NEW,
+    ) -> AgentResult:
+        """
+        Procesa una entrada hasta obtener la respuesta final.
+
+        authorize: si se indica, se llama con cada comando peligroso y debe devolver
+            True para ejecutarlo. Si es None, el bucle se detiene y devuelve
+            status="confirmation_required" para que la confirmación se haga fuera (UI).
+        on_mongo_response: se llama con cada `respuesta mongo` intermedia (p. ej. para mostrarla).
+        priority: prioridad de la primera llamada al LLM ante el límite de cuota; los pasos
+            siguientes de la misma tarea siempre van con prioridad de continuación.
+        """
+        current_input = user_input
+        step = model_router.STEP_TOOL
+        for iteration in range(1, self.max_iterations + 1):
+            log_prefix = f"{self.log_label} Iteration {iteration}"
+            logging_manager.log_debug(log_prefix, f"Input to LLM: {current_input}")
+
+            try:
+                with llm_scheduler.task_priority(priority if iteration == 1 else llm_scheduler.PRIORITY_CONTINUATION):
+                    prompt = self.turns.render(current_input)
+                    with model_router.step_type(step):
+                        model_response_raw = self.llm(prompt)
+                    logging_manager.log_debug(f"{log_prefix} Raw Model Response", model_response_raw)
+                    label, content = communication.parse_model_output(model_response_raw)
+
+                    if not label and step != model_router.STEP_RETRY:
+                        # Respuesta ilegible: se repite el mismo paso por la ruta de reintento
+                        # en lugar de terminar la petición con error.
+                        metrics.increment("llm.output.retried")
+                        with model_router.step_type(model_router.STEP_RETRY):
+                            model_response_raw = self.llm(prompt)
+                        logging_manager.log_debug(f"{log_prefix} Retried Model Response", model_response_raw)
+                        label, content = communication.parse_model_output(model_response_raw)
+                # El historial guarda siempre la forma 'etiqueta: contenido', sea cual sea el formato
+                # de salida del modelo, para que el prompt y sus ejemplos sigan siendo coherentes.
+                self.turns.append(current_input, f"{label}: {content}" if label else model_response_raw)
+
+                if label == "consulta mongo":
+                    command_to_execute = content.strip()
+
+                    if self.is_dangerous(command_to_execute):
+                        logging_manager.log_debug(f"{log_prefix} Dangerous Command Detected", command_to_execute)
+                        if authorize is None:
+                            return AgentResult(
+                                status="confirmation_required",
+                                command_to_confirm=command_to_execute,
+                                response=f"Confirmation needed in UI for command: {command_to_execute}",
+                                iterations=iteration,
+                            )
+                        if not authorize(command_to_execute):
+                            denial = "Comando peligroso detectado y autorización denegada."
+                            self.turns.append(current_input, communication.create_respuesta_usuario(denial))
+                            return AgentResult(status="cancelled", response=denial, iterations=iteration)
+
+                    logging_manager.log_debug(f"{log_prefix} Executing Command", command_to_execute)
+                    output = self.execute(command_to_execute)
+                    logging_manager.log_debug(f"{log_prefix} Mongo Output", output)
+
+                    # La respuesta de mongo es la entrada del siguiente paso; si el comando falló,
+                    # ese paso (corregir el comando) va por la ruta de reintento.
+                    current_input = communication.create_respuesta_mongo(self.compact(output))
+                    step = model_router.STEP_RETRY if any(marker in output for marker in _MONGO_ERROR_MARKERS) else model_router.STEP_TOOL
+                    if on_mongo_response:
+                        on_mongo_response(communication.create_respuesta_mongo(output))
+
+                elif label == "respuesta usuario":
+                    logging_manager.log_debug(f"{self.log_label} Final User Response", content)
+                    return AgentResult(status="completed", response=content, iterations=iteration)
+
+                else:
+                    logging_manager.log_debug(f"{self.log_label} Parse Error", f"Could not parse: {model_response_raw}")
+                    return AgentResult(
+                        status="error",
+                        response=f"Error: Unexpected model response format: {model_response_raw}",
+                        iterations=iteration,
+                    )
+
+            except Exception as e:
+                logging_manager.log_debug(f"{self.log_label} Exception", str(e))
+                return AgentResult(status="error", response=f"An error occurred during processing: {str(e)}", iterations=iteration)
+
+        logging_manager.log_debug(f"{self.log_label} Max Iterations Reached", f"Max iterations ({self.max_iterations}) reached.")
+        return AgentResult(status="error", response="Error: Maximum processing iterations reached.", iterations=self.max_iterations)
+
+    def record_event(self, description: str, summary: str):
+        """
+        Añade al historial algo que pasó fuera del bucle (p. ej. una carga masiva por la API)
+        para que el modelo lo tenga en cuenta en las siguientes peticiones.
+        """
+        self.turns.append(description, communication.create_respuesta_usuario(summary))
+
+    def run_confirmed(self, command: str, **kwargs) -> AgentResult:
+        """
+        Ejecuta un comando ya confirmado por el usuario y continúa el bucle
+        con su resultado como entrada para el modelo.
+        """
+        logging_manager.log_debug(f"{self.log_label} Executing Confirmed Command", command)
+        try:
+            output = self.execute(command)
+        except Exception as e:
+            logging_manager.log_debug(f"{self.log_label} Error Executing Confirmed Command", str(e))
+            return AgentResult(status="error", response=f"Error executing confirmed command '{command}': {str(e)}")
+        logging_manager.log_debug(f"{self.log_label} Confirmed Mongo Output", output)
+        kwargs.setdefault("priority", llm_scheduler.PRIORITY_CONTINUATION)
+        return self.run(communication.create_respuesta_mongo(self.compact(output)), **kwargs)
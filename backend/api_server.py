@@ -1,28 +1,109 @@
+import time
+
+from dotenv import load_dotenv
+
+# Before the local imports: executor, admission, llm_scheduler, profiling... read their
+# settings from the environment at import time, so .env has to be loaded first.
+load_dotenv()
+
+import profiling
+from profiling import startup_profile
+
+_import_started = time.perf_counter()
+
+import asyncio
+import functools
 import os  # Added for path joining
 import uuid
+from contextlib import asynccontextmanager
 from typing import Optional  # Add Optional for the new fields
 
 # Local imports
+import admission
 import communication
 import executor
+import ingest
+import llm_scheduler
 import logging_manager
-import security
+import metrics
+import model_router
+import result_compaction
 import uvicorn
-from fastapi import Body, FastAPI, HTTPException
-from fastapi.responses import FileResponse  # Added for serving index.html
+from fastapi import Body, FastAPI, HTTPException, Request, Response
+from fastapi.responses import FileResponse, JSONResponse  # Added for serving index.html
 from fastapi.staticfiles import StaticFiles  # Added for static files
-# Langchain imports (adjust if needed based on actual usage in main.py)
-from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts.prompt import PromptTemplate
-from model_integration import GeminiLLM
+from agent import AgentEngine
 from pydantic import BaseModel
 
+# NOTE: model_integration (and the langchain base class it depends on) is imported
+# lazily in _load_llm_stack(). It is the heaviest part of the import graph, and the
+# lifespan warm-up pays for it in the background instead of blocking server start.
+
+startup_profile.record("import_api_server", time.perf_counter() - _import_started)
+
+# --- Readiness State ---
+# Filled in by the lifespan warm-up; exposed through /ready
+readiness = {"ready": False, "checks": {}}
+
+
+def _load_llm_stack():
+    """Imports the LLM integration (and the langchain base it depends on); cached by Python after the first call."""
+    import model_integration
+
+
+def _warm_up():
+    """
+    Runs the startup warm-up: imports the LLM stack, pre-spawns and health-checks the
+    mongosh executor and opens the HTTP connection to Gemini. Each step is recorded in
+    the startup profile; the server is ready once every check has passed.
+    """
+    checks = readiness["checks"]
+
+    try:
+        with startup_profile.phase("import_llm_stack"):
+            _load_llm_stack()
+        checks["llm_stack"] = "ok"
+    except Exception as e:
+        logging_manager.log_debug("API Warm-up Error", f"LLM stack import failed: {e}")
+        checks["llm_stack"] = f"error: {e}"
+
+    try:
+        with startup_profile.phase("spawn_executor"):
+            healthy = executor.warm_up()
+        checks["executor"] = "ok" if healthy else "unhealthy"
+    except Exception as e:
+        logging_manager.log_debug("API Warm-up Error", f"Executor warm-up failed: {e}")
+        checks["executor"] = f"error: {e}"
+
+    try:
+        with startup_profile.phase("warm_llm_http"):
+            from model_integration import GeminiLLM
+            reachable = GeminiLLM().warm_up()
+        checks["llm_http"] = "ok" if reachable else "unreachable"
+    except Exception as e:
+        logging_manager.log_debug("API Warm-up Error", f"LLM HTTP warm-up failed: {e}")
+        checks["llm_http"] = f"error: {e}"
+
+    readiness["ready"] = all(status == "ok" for status in checks.values())
+    logging_manager.log_debug("API Startup Profile", startup_profile.format_report())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Clears the previous log and starts the warm-up without delaying the server start."""
+    logging_manager.reset_log()
+    warm_up_task = asyncio.create_task(asyncio.to_thread(_warm_up))
+    yield
+    if not warm_up_task.done():
+        warm_up_task.cancel()
+
+
 # --- FastAPI App Initialization ---
 app = FastAPI(
     title="MongoDB Agent API",
     description="API wrapper for the Langchain MongoDB Agent",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # --- Static Files Mounting ---
@@ -34,8 +115,10 @@ app.mount("/static", StaticFiles(directory=frontend_dir), name="static")
 
 
 # --- In-Memory State Storage ---
-# Stores active ConversationChain instances keyed by session_id
+# Stores active AgentEngine instances (each one holds its own history) keyed by session_id
 conversations = {}
+# Progress of the latest bulk ingest of each session (ingest.IngestProgress) keyed by session_id
+ingest_jobs = {}
 # pending_confirmations dictionary removed as confirmation is now inline
 
 # --- Pydantic Models (for request/response validation) ---
@@ -53,67 +136,6 @@ class ChatResponse(BaseModel):
     response: Optional[str] = None # Final answer or error/info message
     command_to_confirm: Optional[str] = None # The dangerous command needing UI confirmation
 
-# --- Langchain Prompt Template (Copied from main.py) ---
-# TODO: Consider moving this to a separate config file or module
-TEMPLATE = """Eres el agente Gemini-2.0-flash-001, un asistente experto en MongoDB. Interactúas con MongoDB usando la función `execute_mongo_command`.
-
-**Características Clave:**
-
-1.  **Mantenimiento de Contexto:** ¡Importante! El sistema **recuerda** la base de datos seleccionada con `use` entre comandos. Puedes realizar operaciones en varios pasos enviando comandos individuales secuencialmente. Analiza el 'Historial de la conversación' para saber en qué base de datos estás.
-2.  **Comandos Soportados:** Puedes usar la mayoría de comandos estándar de `mongosh`:
-    *   Selección de BD: `use <nombre_db>`
-    *   Información: `db.getName()`, `show dbs`, `show collections`, `db.getCollectionNames()`
-    *   Operaciones CRUD: `db.<col>.insertOne({{ ... }})`, `db.<col>.insertMany([{{...}}, {{...}}])`, `db.<col>.find({{ ... }})`, `db.<col>.updateOne({{ ... }}, {{ ... }})`, `db.<col>.deleteOne({{ ... }})`, `db.<col>.countDocuments({{ ... }})` (Nota: Llaves para JSON deben escaparse como `{{` y `}}`).
-    *   Otros: `print('...')`, `db.runCommand({{ ... }})`
-3.  **Ejecución Secuencial:** Para tareas que requieren múltiples pasos (ej. cambiar de DB y luego buscar), envía **un comando por cada respuesta**. No intentes encadenar comandos con punto y coma (`;`) en una sola respuesta.
-
-**Flujo de Trabajo Autónomo:**
-
-1.  Recibirás una 'Entrada del usuario' inicial. Analízala junto con el 'Historial de la conversación'.
-2.  Determina el primer comando `mongosh` necesario para la tarea.
-3.  Genera tu respuesta como `consulta mongo: <comando>`.
-4.  **IMPORTANTE:** El sistema ejecutará tu comando y te devolverá **inmediatamente** el resultado como una nueva entrada en el historial con la etiqueta `respuesta mongo: <resultado>`.
-5.  **ITERACIÓN:** Analiza esta `respuesta mongo:` y el estado actual de la tarea.
-    *   Si se necesitan más pasos (ej. ejecutar la consulta principal después de un `use`, o realizar otra acción), genera la siguiente `consulta mongo: <siguiente_comando>`. El sistema volverá a ejecutarlo y te dará el resultado.
-    *   Repite este proceso, generando `consulta mongo:` para cada paso necesario.
-6.  **FINALIZACIÓN:** Cuando hayas completado **todos** los pasos necesarios para satisfacer la petición original del usuario, genera tu respuesta final como `respuesta usuario: <mensaje_final_al_usuario>`. Esto detendrá el ciclo de iteración para esa petición.
-7.  **SEGURIDAD:** Si necesitas ejecutar un comando peligroso (ej. `dropDatabase`, `drop`, `delete`), **antes** de generar la `consulta mongo:` para ese comando, genera `respuesta usuario: ¿Estás seguro de que quieres ejecutar [comando peligroso]?`. El sistema gestionará la confirmación del usuario; si es positiva, recibirás una indicación para proceder, momento en el cual generarás la `consulta mongo:` peligrosa. Si es negativa, genera una `respuesta usuario:` informando que se canceló.
-8.  **FORMATO:** Tu respuesta DEBE empezar SIEMPRE con `consulta mongo:` o `respuesta usuario:`, seguido de dos puntos y un espacio.
-
-**Ejemplos de Secuencia Autónoma:**
-
-*   *Usuario: "En la base de datos 'productos', busca los artículos con precio menor a 50 en la colección 'inventario' y dime cuántos hay."*
-    *   *Tu Respuesta 1:* `consulta mongo: use productos`
-    *   *(Sistema añade al historial: respuesta mongo: switched to db productos)*
-    *   *Tu Respuesta 2:* `consulta mongo: db.inventario.find({{ price: {{ $lt: 50 }} }})`
-    *   *(Sistema añade al historial: respuesta mongo: [resultado de la búsqueda])*
-    *   *Tu Respuesta 3:* `consulta mongo: db.inventario.countDocuments({{ price: {{ $lt: 50 }} }})`
-    *   *(Sistema añade al historial: respuesta mongo: 5)*
-    *   *Tu Respuesta 4:* `respuesta usuario: Encontré 5 artículos con precio menor a 50 en la colección 'inventario' de la base de datos 'productos'. Los resultados de la búsqueda se mostraron previamente.`
-
-*   *Usuario: "Muéstrame todas las bases de datos."*
-    *   *Tu Respuesta 1:* `consulta mongo: show dbs`
-    *   *(Sistema añade al historial: respuesta mongo: admin 0.000GB ... local 0.000GB)*
-    *   *Tu Respuesta 2:* `respuesta usuario: Las bases de datos disponibles son admin, local, ...`
-
-*   *Usuario: "Elimina la colección 'logs_viejos' de la base de datos 'auditoria'."*
-    *   *Tu Respuesta 1:* `respuesta usuario: ¿Estás seguro de que quieres ejecutar db.logs_viejos.drop()?`
-    *   *(Usuario confirma)*
-    *   *(Sistema añade al historial: respuesta usuario: Confirmación recibida para db.logs_viejos.drop())* # O similar
-    *   *Tu Respuesta 2:* `consulta mongo: use auditoria`
-    *   *(Sistema añade al historial: respuesta mongo: switched to db auditoria)*
-    *   *Tu Respuesta 3:* `consulta mongo: db.logs_viejos.drop()`
-    *   *(Sistema añade al historial: respuesta mongo: true)*
-    *   *Tu Respuesta 4:* `respuesta usuario: La colección 'logs_viejos' ha sido eliminada de la base de datos 'auditoria'.`
-
-Historial de la conversación:
-{history}
-
-Entrada del usuario: {input}
-Tu respuesta (con etiqueta):"""
-
-PROMPT = PromptTemplate(input_variables=["history", "input"], template=TEMPLATE)
-
 # --- API Endpoints ---
 
 # --- Root Endpoint to serve index.html ---
@@ -125,6 +147,31 @@ async def read_index():
         raise HTTPException(status_code=404, detail="index.html not found")
     return FileResponse(index_path)
 
+# --- Readiness Endpoint ---
+@app.get("/ready")
+async def ready():
+    """
+    Reports whether the startup warm-up has finished and every check passed,
+    together with the startup-time profile. Returns 503 until the server is ready.
+    """
+    body = {**readiness, "startup_profile": startup_profile.report()}
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=body)
+
+# --- Metrics Endpoint ---
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Returns the in-process metrics (counters, gauges, timings), the model output format stats,
+    the LLM quota budget, per-route model stats and the token savings of result compaction.
+    """
+    return {
+        **metrics.snapshot(),
+        "llm_output_format": communication.output_format_stats(),
+        "llm_budget": llm_scheduler.gemini_scheduler.usage(),
+        "llm_routes": model_router.gemini_router.stats(),
+        "result_compaction": result_compaction.compaction_stats(),
+    }
+
 # --- Existing API Endpoints ---
 @app.post("/start_conversation", response_model=SessionResponse)
 async def start_conversation():
@@ -133,16 +180,17 @@ async def start_conversation():
     """
     session_id = str(uuid.uuid4())
     try:
+        _load_llm_stack() # No-op once the warm-up has run
+        from model_integration import GeminiLLM
+
         llm = GeminiLLM()
-        # Use different prefixes for API context if needed, or keep as is
-        memory = ConversationBufferMemory(memory_key="history", human_prefix="consulta usuario", ai_prefix="respuesta modelo")
-        conversation = ConversationChain(
-            llm=llm,
-            prompt=PROMPT,
-            verbose=False, # Set to True for debugging API requests
-            memory=memory
+        conversations[session_id] = AgentEngine(
+            llm=llm.complete, # Concurrency is capped (by priority) in llm_scheduler
+            # Each session keeps its own current database in the shared mongosh shell
+            execute=admission.mongo_limiter.wrap(functools.partial(executor.execute_mongo_command, session_id=session_id)),
+            log_label=f"API Chat [{session_id}]",
+            response_mode=llm.response_mode,
         )
-        conversations[session_id] = conversation
         logging_manager.log_debug("API", f"Started new session: {session_id}")
         return {"session_id": session_id}
     except Exception as e:
@@ -150,120 +198,146 @@ async def start_conversation():
         raise HTTPException(status_code=500, detail=f"Failed to initialize conversation: {str(e)}")
 
 
+# X-Profile / ?profile= values that mean "off" or "on with the default mode"
+_PROFILE_OFF = ("", "0", "false", "off", "no")
+_PROFILE_ON = ("1", "true", "on", "yes")
+
+
 @app.post("/chat/{session_id}", response_model=ChatResponse)
-async def chat(session_id: str, query: UserQuery):
+async def chat(session_id: str, query: UserQuery, request: Request, response: Response, profile: Optional[str] = None):
     """
     Handles user interaction: initial query, LLM interaction, command execution,
     and UI-based confirmation for dangerous commands.
+
+    Profiling is opt-in per request: with an `X-Profile` header or `?profile=` query
+    parameter ("1"/"sampling" or "cprofile") the whole agent loop runs under the profiler
+    and the path of the saved profile is returned in the `X-Profile-File` header.
     """
     if session_id not in conversations:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    conversation = conversations[session_id]
+    agent_engine = conversations[session_id]
     logging_manager.log_debug(f"API Chat [{session_id}] Received Query", query.model_dump_json()) # Log entire query
 
-    # --- Determine Starting Input for LLM ---
-    current_input = None
-    initial_command_executed = False # Flag to track if we executed a confirmed command first
-
     if query.confirmed_command:
-        # User confirmed a dangerous command via UI
+        # User confirmed a dangerous command via UI: run it, then let the agent continue from its output
         confirmed_cmd = query.confirmed_command
-        logging_manager.log_debug(f"API Chat [{session_id}] Executing Confirmed Command", confirmed_cmd)
         # Security check again? Maybe not strictly needed if we trust the flow, but belt-and-suspenders:
-        if not security.is_command_dangerous(confirmed_cmd):
+        if not executor.is_command_dangerous(confirmed_cmd):
              logging_manager.log_debug(f"API Chat [{session_id}] Warning", f"Confirmed command '{confirmed_cmd}' was not marked dangerous?")
-             # Decide how to handle - proceed cautiously or error out? Let's proceed for now.
-
-        try:
-            output = executor.execute_mongo_command(confirmed_cmd)
-            logging_manager.log_debug(f"API Chat [{session_id}] Confirmed Mongo Output", output)
-            # Format response to feed back to LLM
-            current_input = communication.create_respuesta_mongo(output)
-            initial_command_executed = True
-        except Exception as e:
-            logging_manager.log_debug(f"API Chat [{session_id}] Error Executing Confirmed Command", str(e))
-            return ChatResponse(status="error", response=f"Error executing confirmed command '{confirmed_cmd}': {str(e)}")
+        run_agent = lambda: agent_engine.run_confirmed(confirmed_cmd)
 
     elif query.user_query:
         # Normal user query
-        current_input = query.user_query
-        logging_manager.log_debug(f"API Chat [{session_id}] User Query", current_input)
+        logging_manager.log_debug(f"API Chat [{session_id}] User Query", query.user_query)
+        run_agent = lambda: agent_engine.run(query.user_query)
     else:
         # Invalid request - needs either user_query or confirmed_command
         raise HTTPException(status_code=400, detail="Request must contain either 'user_query' or 'confirmed_command'")
 
-    # --- LLM Interaction Loop ---
-    MAX_ITERATIONS = 10
-    for iteration in range(MAX_ITERATIONS):
-        # If we already executed a confirmed command, this is the first LLM interaction *after* that.
-        # If it was a normal user query, this is the first interaction.
-        log_prefix = f"API Chat [{session_id}] Iteration {iteration+1}"
-        if initial_command_executed and iteration == 0:
-            log_prefix += " (Post-Confirmation)"
-
-        logging_manager.log_debug(log_prefix, f"Input to LLM: {current_input}")
-
-        try:
-            # Get response from the model
-            model_response_raw = conversation.predict(input=current_input)
-            logging_manager.log_debug(f"API Chat [{session_id}] Raw Model Response", model_response_raw)
-
-            # Process response
-            label, content = communication.parse_message(model_response_raw)
-
-            if not label:
-                logging_manager.log_debug(f"API Chat [{session_id}] Parse Error", f"Could not parse: {model_response_raw}")
-                # Save unparsed response to memory? Maybe just return error.
-                # conversation.memory.save_context({"input": current_input}, {"output": f"respuesta usuario: {model_response_raw}"})
-                return ChatResponse(status="error", response=f"Error: Unexpected model response format: {model_response_raw}")
-
-            # Handle 'consulta mongo'
-            if label == "consulta mongo":
-                command_to_execute = content.strip()
-
-                # Security Check
-                if security.is_command_dangerous(command_to_execute):
-                    logging_manager.log_debug(f"{log_prefix} Dangerous Command Detected", command_to_execute)
-                    # --- STOP and Request UI Confirmation ---
-                    return ChatResponse(
-                        status="confirmation_required",
-                        command_to_confirm=command_to_execute,
-                        response=f"Confirmation needed in UI for command: {command_to_execute}" # Optional info message
+    profile_mode = (profile or request.headers.get("x-profile") or "").strip().lower()
+    if profile_mode in _PROFILE_OFF:
+        profile_mode = None
+    if profile_mode:
+        profile_mode = profiling.DEFAULT_PROFILE_MODE if profile_mode in _PROFILE_ON else profile_mode
+        if profile_mode not in profiling.PROFILE_MODES:
+            raise HTTPException(status_code=400, detail=f"Unknown profile mode '{profile_mode}' (expected 1, {', '.join(profiling.PROFILE_MODES)})")
+        unprofiled_agent = run_agent
+        run_agent = lambda: profiling.run_profiled(unprofiled_agent, f"chat-{session_id}", profile_mode)
+
+    # One request per session at a time, bounded global concurrency; the blocking
+    # agent loop runs in a worker thread so it doesn't stall the event loop.
+    try:
+        async with admission.chat_admission.admit(session_id):
+            result = await asyncio.to_thread(run_agent)
+    except admission.AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=f"{e}. Retry in {e.retry_after}s.", headers={"Retry-After": str(e.retry_after)})
+    except profiling.ProfilerBusy as e:
+        # Raised before the agent runs, so the request can simply be retried
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if profile_mode:
+        result, profile_path = result
+        response.headers["X-Profile-File"] = os.path.abspath(profile_path)
+        logging_manager.log_debug(f"API Chat [{session_id}] Profile", profile_path)
+
+    return ChatResponse(status=result.status, response=result.response, command_to_confirm=result.command_to_confirm)
+
+
+# --- Bulk Ingest Endpoints ---
+@app.post("/ingest/{session_id}")
+async def ingest_documents(
+    session_id: str,
+    request: Request,
+    database: str,
+    collection: str,
+    format: Optional[str] = None,
+    batch_size: int = ingest.DEFAULT_BATCH_SIZE,
+    ordered: bool = True,
+):
+    """
+    Loads a JSON-lines or CSV upload (raw request body) straight into database.collection
+    with batched insert_many calls, without going through the LLM or mongosh. The body is
+    read as a stream, so uploads of any size use constant memory. When finished, a summary
+    turn is added to the session history so the agent knows what was loaded.
+    """
+    if session_id not in conversations:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if not 1 <= batch_size <= ingest.MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"batch_size must be between 1 and {ingest.MAX_BATCH_SIZE}")
+    if format is None:
+        format = ingest.FORMAT_CSV if "csv" in request.headers.get("content-type", "") else ingest.FORMAT_JSONL
+    if format not in ingest.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format '{format}' (expected one of {', '.join(ingest.FORMATS)})")
+    # Same whitelist as the database names the agent may select
+    if not executor.is_valid_database_name(database):
+        raise HTTPException(status_code=400, detail=f"Invalid database name {database!r} (allowed: letters, digits, '_' and '-')")
+    if not ingest.is_valid_collection_name(collection):
+        raise HTTPException(status_code=400, detail=f"Invalid collection name {collection!r}")
+    current = ingest_jobs.get(session_id)
+    if current is not None and current.status == "running":
+        raise HTTPException(status_code=409, detail="An ingest is already running for this session")
+
+    # Registered before the first await, so a concurrent upload for the session gets the 409
+    progress = ingest.IngestProgress(database=database, collection=collection, format=format, ordered=ordered, batch_size=batch_size)
+    ingest_jobs[session_id] = progress
+    try:
+        write_batch = await asyncio.to_thread(ingest.mongo_writer, database, collection)
+    except Exception as e:
+        progress.status, progress.finished = "failed", time.monotonic()
+        progress.add_errors([str(e)])
+        if isinstance(e, ingest.IngestError):
+            raise HTTPException(status_code=400, detail=str(e))
+        logging_manager.log_debug(f"API Ingest [{session_id}] Error", f"Could not connect to MongoDB: {e}")
+        raise HTTPException(status_code=503, detail=f"Could not connect to MongoDB: {str(e)}")
+
+    documents = ingest.iter_documents(ingest.iter_lines(request.stream()), format)
+    try:
+        await ingest.ingest(documents, write_batch, progress, run_blocking=asyncio.to_thread)
+    except Exception as e:
+        logging_manager.log_debug(f"API Ingest [{session_id}] Error", str(e))
+        progress.add_errors([str(e)])
+    finally:
+        if progress.received:
+            # The summary turn goes through the session's admission slot, like a chat turn,
+            # so it never interleaves with an agent run appending to the same history.
+            try:
+                async with admission.chat_admission.admit(session_id):
+                    conversations[session_id].record_event(
+                        f"(carga masiva por la API: {format} en {database}.{collection})", progress.summary()
                     )
-                else:
-                    # Execute safe command
-                    logging_manager.log_debug(f"{log_prefix} Executing Safe Command", command_to_execute)
-                    output = executor.execute_mongo_command(command_to_execute)
-                    logging_manager.log_debug(f"{log_prefix} Mongo Output", output)
-
-                    # Format response for the next LLM turn
-                    respuesta_mongo_etiquetada = communication.create_respuesta_mongo(output)
-                    logging_manager.log_debug(f"{log_prefix} Formatted Mongo Response", respuesta_mongo_etiquetada)
-
-                    # Prepare for the next iteration
-                    current_input = respuesta_mongo_etiquetada
-                    # Continue the loop
-
-            # Handle 'respuesta usuario'
-            elif label == "respuesta usuario":
-                logging_manager.log_debug(f"API Chat [{session_id}] Final User Response", content)
-                # Task completed by the agent
-                return ChatResponse(status="completed", response=content)
-
-            else:
-                # Unknown label
-                logging_manager.log_debug(f"API Chat [{session_id}] Unknown Label", f"Label: {label}, Content: {content}")
-                return ChatResponse(status="error", response=f"Error: Unknown label in model response: {label}")
-
-        except Exception as e:
-            logging_manager.log_debug(f"API Chat [{session_id}] Exception", str(e))
-            # Consider saving context on error?
-            return ChatResponse(status="error", response=f"An error occurred during processing: {str(e)}")
-
-    # If loop finishes without returning, it means max iterations were hit
-    logging_manager.log_debug(f"API Chat [{session_id}] Max Iterations Reached", f"Max iterations ({MAX_ITERATIONS}) reached.")
-    return ChatResponse(status="error", response="Error: Maximum processing iterations reached.")
+            except admission.AdmissionRejected as e:
+                logging_manager.log_debug(f"API Ingest [{session_id}] Error", f"Summary not added to the history: {e}")
+    return progress.to_dict()
+
+
+@app.get("/ingest/{session_id}/progress")
+async def ingest_progress(session_id: str):
+    """Returns the progress (or final summary) of the session's latest bulk ingest."""
+    progress = ingest_jobs.get(session_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="No ingest found for this session")
+    return progress.to_dict()
 
 
 # --- Run Server (for local development) ---
@@ -0,0 +1,45 @@
+# bench_agent.py
+# Mide el coste por iteración del bucle del agente (sin LLM ni mongosh reales)
+# para distintos tamaños de historial. Con el TurnBuffer el coste debe mantenerse
+# prácticamente constante aunque crezca el historial.
+#
+# Uso: python bench_agent.py
+import os
+import time
+
+import logging_manager
+
+logging_manager.LOG_FILE = os.devnull # El log a disco no es parte de lo que se mide
+
+from agent import AgentEngine
+
+MONGO_OUTPUT = "[ { _id: ObjectId('65f1c0a1b2c3d4e5f6a7b8c9'), name: 'Alice', age: 30 } ]"
+HISTORY_SIZES = [0, 10, 100, 1000]
+ITERATIONS = 500
+
+
+def stub_llm(prompt: str) -> str:
+    return "consulta mongo: db.users.find({ age: { $gt: 18 } })"
+
+
+def stub_execute(command: str) -> str:
+    return MONGO_OUTPUT
+
+
+def bench(history_size: int) -> float:
+    """Devuelve los microsegundos por iteración con `history_size` turnos previos."""
+    engine = AgentEngine(llm=stub_llm, execute=stub_execute, max_iterations=ITERATIONS)
+    for i in range(history_size):
+        engine.turns.append(f"respuesta mongo: {MONGO_OUTPUT}", stub_llm(""))
+
+    start = time.perf_counter()
+    engine.run("Muéstrame los usuarios mayores de edad")
+    elapsed = time.perf_counter() - start
+    # Cada iteración añade un turno, así que el historial medio es history_size + ITERATIONS / 2
+    return elapsed / ITERATIONS * 1e6
+
+
+if __name__ == "__main__":
+    print(f"{'historial previo':>18} {'us/iteración':>14}")
+    for size in HISTORY_SIZES:
+        print(f"{size:>18} {bench(size):>14.1f}")
@@ -1,4 +1,30 @@
 # communication.py
+import json
+import re
+
+import metrics
+
+LABEL_CONSULTA_MONGO = "consulta mongo"
+LABEL_RESPUESTA_USUARIO = "respuesta usuario"
+
+# Esquema de salida estructurada (formato de responseSchema de la API de Gemini).
+# El modelo devuelve {"action": ..., "command": ..., "database": ...} o {"action": ..., "message": ...}.
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "action": {"type": "STRING", "enum": [LABEL_CONSULTA_MONGO, LABEL_RESPUESTA_USUARIO]},
+        "command": {"type": "STRING", "description": "Comando mongosh a ejecutar (solo si action es 'consulta mongo')."},
+        "database": {"type": "STRING", "description": "Base de datos en la que ejecutar el comando (opcional; por defecto la seleccionada en la sesión)."},
+        "message": {"type": "STRING", "description": "Mensaje para el usuario (solo si action es 'respuesta usuario')."},
+    },
+    "required": ["action"],
+    "propertyOrdering": ["action", "command", "database", "message"],
+}
+
+# Validación precompilada del esquema: acción -> campo que debe traer el contenido
+_ACTION_FIELDS = {LABEL_CONSULTA_MONGO: "command", LABEL_RESPUESTA_USUARIO: "message"}
+_LABEL_RE = re.compile(r"(consulta mongo|respuesta usuario):\s*(.*)", re.DOTALL)
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
 
 def create_consulta_usuario(message: str) -> str:
     """Formato para una consulta del usuario."""
@@ -12,6 +38,10 @@ def create_consulta_mongo(command: str) -> str:
     """Formato para la consulta a mongo."""
     return f"consulta mongo: {command}"
 
+def with_database(command: str, database: str) -> str:
+    """Comando con la base de datos de destino delante ('use <db>; <comando>'), como lo entiende el ejecutor."""
+    return f"use {database}; {command}"
+
 def create_respuesta_mongo(output: str) -> str:
     """Formato para la respuesta de mongo."""
     return f"respuesta mongo: {output}"
@@ -24,11 +54,9 @@ def parse_message(message: str):
     Ignora texto previo a la etiqueta (como timestamps).
     Si no se encuentra el patrón, devuelve (None, message).
     """
-    import re  # Importar re aquí o al principio del archivo
-
     # Buscar el patrón 'etiqueta: contenido', permitiendo texto antes
     # Se busca 'consulta mongo:' o 'respuesta usuario:' seguido de ':' y el resto
-    match = re.search(r"(consulta mongo|respuesta usuario):\s*(.*)", message, re.DOTALL)
+    match = _LABEL_RE.search(message)
 
     if match:
         label = match.group(1).strip() # La etiqueta encontrada
@@ -37,3 +65,75 @@ def parse_message(message: str):
     else:
         # Si no se encuentra el patrón específico, devolver None y el mensaje original
         return None, message
+
+def _validate_structured(data):
+    """
+    Valida un objeto ya decodificado contra RESPONSE_SCHEMA en una sola pasada.
+    Devuelve (etiqueta, contenido) o None si no cumple el esquema.
+    """
+    if not isinstance(data, dict):
+        return None
+    label = data.get("action")
+    field = _ACTION_FIELDS.get(label)
+    content = data.get(field) if field else None
+    if not isinstance(content, str) or not content.strip():
+        return None
+    database = data.get("database")
+    if label == LABEL_CONSULTA_MONGO and isinstance(database, str) and database.strip():
+        return label, with_database(content.strip(), database.strip())
+    return label, content.strip()
+
+
+def parse_structured_message(message: str):
+    """
+    Parsea una respuesta en modo JSON ({"action", "command", "database", "message"}).
+    Devuelve (etiqueta, contenido) o (None, message) si no es un JSON válido según el esquema.
+    """
+    try:
+        parsed = _validate_structured(json.loads(message))
+    except ValueError:
+        parsed = None
+    return parsed if parsed else (None, message)
+
+
+def parse_model_output(message: str):
+    """
+    Punto único de parseo de la salida del modelo. Intenta, en orden:
+      1. JSON estructurado tal cual                        -> métrica llm.output.json_ok
+      2. JSON reparado (vallas ``` o texto alrededor)      -> métrica llm.output.repaired
+      3. Protocolo de texto 'etiqueta: contenido'          -> métrica llm.output.text_ok
+    Si nada funciona cuenta llm.output.format_failed y devuelve (None, message).
+    """
+    text = message.strip()
+    if text.startswith("{"):
+        label, content = parse_structured_message(text)
+        if label:
+            metrics.increment("llm.output.json_ok")
+            return label, content
+
+    json_match = _JSON_OBJECT_RE.search(text) if '"action"' in text else None
+    if json_match and json_match.group() != text:
+        label, content = parse_structured_message(json_match.group())
+        if label:
+            metrics.increment("llm.output.repaired")
+            return label, content
+
+    label, content = parse_message(text)
+    if label:
+        metrics.increment("llm.output.text_ok")
+        return label, content
+
+    metrics.increment("llm.output.format_failed")
+    return None, message
+
+
+def output_format_stats() -> dict:
+    """Número de respuestas por resultado de parseo y tasas de reparación y fallo."""
+    counts = {name: metrics.get_counter(f"llm.output.{name}") for name in ("json_ok", "repaired", "text_ok", "format_failed")}
+    total = sum(counts.values())
+    return {
+        **counts,
+        "total": total,
+        "repair_rate": round(counts["repaired"] / total, 4) if total else 0.0,
+        "failure_rate": round(counts["format_failed"] / total, 4) if total else 0.0,
+    }
@@ -0,0 +1,7 @@
+# conftest.py
+import os
+
+import logging_manager
+
+# Las pruebas no escriben en el log real del agente (igual que bench_agent.py)
+logging_manager.LOG_FILE = os.devnull
@@ -1,72 +1,362 @@
 # executor.py
 import atexit
+import json
+import os
 import queue
 import re  # Importar el módulo re
 import subprocess
 import threading
 import time
+import uuid
+from collections import defaultdict, deque
 
 import logging_manager
+import metrics
+import security
+from mongosh_lexer import tokenize
+
+# --- Timeouts per command class ---
+# Starting timeout (seconds) for each class until enough latency samples exist. It is
+# also the floor the learned timeout never goes below (MONGO_TIMEOUT_MIN_<CLASS>), and
+# TIMEOUT_CAPS is the hard cap it can never exceed (MONGO_TIMEOUT_CAP_<CLASS>,
+# e.g. MONGO_TIMEOUT_CAP_AGGREGATE=120).
+DEFAULT_TIMEOUTS = {"shell": 5, "find": 10, "count": 10, "aggregate": 30, "write": 15, "admin": 15, "other": 10}
+TIMEOUT_CAPS = {
+    name: float(os.getenv(f"MONGO_TIMEOUT_CAP_{name.upper()}", cap))
+    for name, cap in {"shell": 15, "find": 60, "count": 60, "aggregate": 300, "write": 60, "admin": 60, "other": 60}.items()
+}
+TIMEOUT_FLOORS = {
+    name: min(float(os.getenv(f"MONGO_TIMEOUT_MIN_{name.upper()}", default)), TIMEOUT_CAPS[name])
+    for name, default in DEFAULT_TIMEOUTS.items()
+}
+
+# --- mongosh processes ---
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017") # Shared with the bulk ingest client
+STANDBY_ENABLED = os.getenv("MONGO_STANDBY", "1") != "0" # Keep a pre-spawned shell ready for failover
+PING_INTERVAL = float(os.getenv("MONGO_PING_INTERVAL", "10")) # Seconds between liveness pings (0 disables them)
+PING_TIMEOUT = float(os.getenv("MONGO_PING_TIMEOUT", "3"))
+
+_CURSOR_METHODS = {"find", "aggregate", "sort", "limit", "skip", "project", "projection", "hint", "batchSize", "collation", "comment", "allowDiskUse"}
+_WRITE_METHODS = {"insert", "insertOne", "insertMany", "update", "updateOne", "updateMany", "replaceOne", "bulkWrite",
+                  "deleteOne", "deleteMany", "remove", "findOneAndUpdate", "findOneAndReplace", "findOneAndDelete", "save"}
+_COUNT_METHODS = {"countDocuments", "estimatedDocumentCount", "count", "distinct"}
+# 'use <db>' alone or as a prefix of the command ('use ventas; db.pedidos.find()')
+_USE_RE = re.compile(r"use\s+([^\s;]+)\s*(?:;\s*(.*))?$", re.DOTALL)
+_SHOW_RE = re.compile(r"show\s+(\w+)(?:\s+[\w.-]+)?\s*;?$")
+# Database-scoped 'show' helpers as the equivalent calls on a given database ({db} = getSiblingDB(...));
+# the rest (show dbs, show log ...) are server-wide and go through unchanged
+_SHOW_HELPERS = {
+    "collections": "print({db}.getCollectionNames().join('\\n'))",
+    "tables": "print({db}.getCollectionNames().join('\\n'))",
+    "users": "{db}.getUsers()",
+    "roles": "{db}.getRoles({{ showBuiltinRoles: true }})",
+    "profile": "{db}.system.profile.find({{ millis: {{ $gt: 0 }} }}).sort({{ $natural: -1 }}).limit(5)",
+}
+_SHELL_HELPERS = {"use", "show"}
+# Database names accepted from the model: a whitelist, since the name ends up inside JavaScript
+_VALID_DB_NAME_RE = re.compile(r"[A-Za-z0-9_-]{1,63}")
+_APP_NAME_RE = re.compile(r"([?&])appName=[^&]*", re.IGNORECASE)
+_KILLED_RE = re.compile(r"killed:(\d+)") # Answer of the killOp script in _kill_server_operations
+_PROMPT_PREFIX_RE = re.compile(r"^(?:[\w.-]*> )+") # Prompts ('test> ') glued to the start of a line
+
+
+def _top_level_calls(command: str):
+    """Names of the methods called at the top level of the expression (not inside arguments), in order."""
+    calls = []
+    depth = 0
+    tokens = tokenize(command)
+    for i, token in enumerate(tokens):
+        if token.value in ("(", "[", "{"):
+            depth += 1
+        elif token.value in (")", "]", "}"):
+            depth -= 1
+        elif depth == 0 and token.kind == "ident" and i + 1 < len(tokens) and tokens[i + 1].value == "(":
+            calls.append(token.value)
+    return calls
+
+
+def command_class(command: str) -> str:
+    """Classifies a command for timeout purposes: shell, find, aggregate, count, write, admin or other."""
+    stripped = command.strip()
+    if re.match(r"(use|show|print|it)\b", stripped):
+        return "shell"
+    calls = _top_level_calls(stripped)
+    for name in calls:
+        if name in ("find", "findOne"):
+            return "find"
+        if name == "aggregate":
+            return "aggregate"
+        if name in _COUNT_METHODS:
+            return "count"
+        if name in _WRITE_METHODS:
+            return "write"
+        if name in ("runCommand", "adminCommand"):
+            return "admin"
+    return "other"
+
+
+def with_max_time(command: str, max_time_ms: int) -> str:
+    """
+    Attaches .maxTimeMS() to find/aggregate cursors so the server stops the
+    operation on its own if we give up waiting. Commands that already set it,
+    or whose chain does not end in a cursor (toArray(), forEach(), ...), are left as is.
+    """
+    stripped = command.strip().rstrip(";")
+    if "maxTimeMS" in stripped or not stripped.endswith(")"):
+        return command
+    calls = _top_level_calls(stripped)
+    if not calls or calls[-1] not in _CURSOR_METHODS or not ({"find", "aggregate"} & set(calls)):
+        return command
+    return f"{stripped}.maxTimeMS({max_time_ms})"
+
+
+def with_app_name(uri: str, app_name: str) -> str:
+    """The connection string with its appName option set (added or replaced)."""
+    if _APP_NAME_RE.search(uri):
+        return _APP_NAME_RE.sub(lambda match: f"{match.group(1)}appName={app_name}", uri, count=1)
+    if "?" in uri:
+        return f"{uri}&appName={app_name}"
+    # The options need the '/' that ends the host list: mongodb://host/?appName=...
+    return f"{uri}{'' if '/' in uri.split('://', 1)[-1] else '/'}?appName={app_name}"
+
+
+def mongosh_command(app_name: str) -> list:
+    """
+    mongosh against MONGO_URI. Each process connects with its own appName, so the
+    operations it leaves running on the server can be found and killed after a timeout.
+    """
+    return ["mongosh", with_app_name(MONGO_URI, app_name), "--quiet"] # --quiet suppresses connection messages
 
 
-class MongoExecutor:
+def normalize_command(command: str) -> str:
+    """Canonical form of a command (tokens joined by single spaces, no comments or trailing ';'), used as coalescing key."""
+    return " ".join(token.value for token in tokenize(command.strip().rstrip(";")))
+
+
+def is_coalescable(command: str) -> bool:
+    """
+    Only read-only commands that don't depend on shell state can share a result:
+    'use' changes the session and 'it' continues the previous cursor.
+    """
+    stripped = command.strip()
+    if re.match(r"(use|it)\b", stripped):
+        return False
+    return security.classify_command(stripped) == security.READ
+
+
+def split_use(command: str):
+    """
+    Splits a leading 'use <db>' off a command. Returns (database, rest): ('ventas', '')
+    for a bare 'use ventas', ('ventas', 'db.pedidos.find()') for 'use ventas; db.pedidos.find()'
+    and (None, command) when the command does not start with 'use'.
+    """
+    match = _USE_RE.match(command.strip())
+    if not match:
+        return None, command
+    return match.group(1).strip("'\""), (match.group(2) or "").strip()
+
+
+def is_valid_database_name(database: str) -> bool:
+    return bool(database) and _VALID_DB_NAME_RE.fullmatch(database) is not None
+
+
+def _check_shell_helpers(command: str, tokens):
+    """
+    Raises ValueError if a 'use'/'show' shell helper starts any statement or line of the
+    command: mongosh would run it against the shared shell, outside the session's database.
+    A whole-command 'show <helper>' is handled by pin_to_database before this check.
+    """
+    for i, token in enumerate(tokens):
+        if token.kind != "ident" or token.value not in _SHELL_HELPERS or i + 1 >= len(tokens):
+            continue
+        starts_statement = i == 0 or tokens[i - 1].value == ";" or "\n" in command[tokens[i - 1].end:token.start]
+        if starts_statement and tokens[i + 1].kind in ("ident", "string"):
+            if token.value == "use":
+                raise ValueError("only one leading 'use <db>' is allowed per command")
+            raise ValueError("'show' helpers must be sent as a command of their own")
+
+
+def pin_to_database(command: str, database: str) -> str:
+    """
+    Rewrites a command so it runs against `database` whatever the shell's current
+    database is: every free-standing `db` identifier becomes db.getSiblingDB("<database>")
+    and the database-scoped 'show' helpers (collections, users, roles, profile) become
+    the equivalent calls. Property accesses (x.db) and object keys ({ db: 1 }) are left alone.
+    Raises ValueError for names outside the whitelist and for 'use'/'show' helpers
+    embedded in the command, which the shell would run against its own database.
+    """
+    if not is_valid_database_name(database):
+        raise ValueError(f"invalid database name {database!r}")
+    sibling = f"db.getSiblingDB({json.dumps(database)})"
+    stripped = command.strip()
+    show = _SHOW_RE.match(stripped)
+    if show:
+        helper = _SHOW_HELPERS.get(show.group(1))
+        return helper.format(db=sibling) if helper else stripped
+
+    tokens = tokenize(command)
+    _check_shell_helpers(command, tokens)
+    pieces, pos = [], 0
+    for i, token in enumerate(tokens):
+        if token.kind != "ident" or token.value != "db":
+            continue
+        if i > 0 and tokens[i - 1].value == ".":
+            continue
+        if i + 1 < len(tokens) and tokens[i + 1].value == ":" and (i == 0 or tokens[i - 1].value in ("{", ",")):
+            continue
+        pieces.append(command[pos:token.start])
+        pieces.append(sibling)
+        pos = token.end
+    pieces.append(command[pos:])
+    return "".join(pieces)
+
+
+def pinned_command(command: str, database: str = None) -> str:
+    """
+    The command exactly as it would reach mongosh: without its 'use <db>;' prefix and
+    pinned to that database (or `database`, or the default one). This is what the
+    safety check must classify. Raises ValueError for an invalid database name.
+    """
+    use_db, rest = split_use(command)
+    return pin_to_database(rest, use_db or database or DEFAULT_DATABASE)
+
+
+def is_command_dangerous(command: str) -> bool:
+    """security.is_command_dangerous applied to the command as it will actually run."""
+    try:
+        return security.is_command_dangerous(pinned_command(command))
+    except ValueError:
+        return True # Never reaches the shell (rejected), but never pass it as safe either
+
+
+class _InFlightCall:
     def __init__(self):
-        self.process = None
-        self.output_queue = queue.Queue()
-        self.lock = threading.Lock()
-        self.prompt_pattern = "\n> " # Default prompt pattern, might change based on DB
-        self._start_process()
-        atexit.register(self._stop_process) # Ensure cleanup on exit
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
 
-    def _start_process(self):
-        if self.process and self.process.poll() is None:
-            # Process already running
-            return
 
-        logging_manager.log_debug("Executor", "Starting new mongosh process...")
-        try:
-            # Start mongosh, connect pipes for stdin, stdout, stderr
-            self.process = subprocess.Popen(
-                ["mongosh", "--quiet"], # --quiet suppresses connection messages
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                encoding='utf-8',
-                bufsize=1, # Line buffered
-                universal_newlines=True # Ensures text mode works correctly
-            )
-
-            # Start threads to read stdout and stderr without blocking
-            self.stdout_thread = threading.Thread(target=self._read_output, args=(self.process.stdout,), daemon=True)
-            self.stderr_thread = threading.Thread(target=self._read_output, args=(self.process.stderr,), daemon=True)
-            self.stdout_thread.start()
-            self.stderr_thread.start()
-
-            # Wait briefly for the process to initialize and potentially show the first prompt
-            time.sleep(0.5)
-            # Consume any initial output/prompt
-            self._read_until_prompt(timeout=2)
-            logging_manager.log_debug("Executor", "mongosh process started successfully.")
+class SingleFlight:
+    """
+    De-duplicates identical concurrent calls: the first caller for a key runs the
+    function and every caller that arrives while it is in flight waits for, and
+    receives, the same result instead of queueing its own execution.
+    """
 
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _InFlightCall()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            metrics.increment(f"{self.name}.coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        metrics.increment(f"{self.name}.executed")
+        try:
+            call.result = func()
+            return call.result
         except Exception as e:
-            logging_manager.log_debug("Executor Error", f"Failed to start mongosh process: {e}")
-            self.process = None
-            raise RuntimeError(f"Failed to start mongosh process: {e}")
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if call.waiters:
+                logging_manager.log_debug("Executor", f"Coalesced {call.waiters} identical call(s) into one: {key}")
 
-    def _stop_process(self):
-        if self.process and self.process.poll() is None:
-            logging_manager.log_debug("Executor", "Stopping mongosh process...")
-            try:
-                self.process.terminate() # Try graceful termination
-                self.process.wait(timeout=5) # Wait for termination
-            except subprocess.TimeoutExpired:
-                logging_manager.log_debug("Executor", "mongosh process did not terminate gracefully, killing.")
-                self.process.kill() # Force kill if terminate fails
-            except Exception as e:
-                 logging_manager.log_debug("Executor Error", f"Error stopping mongosh: {e}")
-            self.process = None
-            logging_manager.log_debug("Executor", "mongosh process stopped.")
+
+class TimeoutPolicy:
+    """
+    Learns a timeout per command class from the observed latencies:
+    roughly 3x the recent p95 (plus a small margin), clamped to
+    [TIMEOUT_FLOORS[class], TIMEOUT_CAPS[class]]. Until a class has a few
+    samples its DEFAULT_TIMEOUTS value is used.
+
+    A timed-out command is a censored sample: it took *at least* the timeout.
+    It is recorded with that lower bound and the class timeout backs off
+    (doubles, up to the cap) after each consecutive timeout, so a class whose
+    commands got slower can grow past what the fast history predicted. The
+    back-off is cleared by the next command of the class that completes.
+    """
+
+    def __init__(self, window: int = 50, min_samples: int = 5, multiplier: float = 3.0, margin: float = 0.5, backoff: float = 2.0):
+        self.window = window
+        self.min_samples = min_samples
+        self.multiplier = multiplier
+        self.margin = margin
+        self.backoff = backoff
+        self.latencies = defaultdict(lambda: deque(maxlen=self.window))
+        self.backoffs = defaultdict(lambda: 1.0)
+        self.lock = threading.Lock()
+
+    def record(self, cls: str, seconds: float):
+        with self.lock:
+            self.latencies[cls].append(seconds)
+            self.backoffs.pop(cls, None)
+
+    def record_timeout(self, cls: str, timeout: float):
+        with self.lock:
+            self.latencies[cls].append(timeout)
+            self.backoffs[cls] *= self.backoff
+
+    def timeout_for(self, cls: str) -> float:
+        cap = TIMEOUT_CAPS.get(cls, TIMEOUT_CAPS["other"])
+        floor = TIMEOUT_FLOORS.get(cls, TIMEOUT_FLOORS["other"])
+        with self.lock:
+            samples = sorted(self.latencies[cls])
+            backoff = self.backoffs.get(cls, 1.0)
+        if len(samples) < self.min_samples:
+            learned = DEFAULT_TIMEOUTS.get(cls, DEFAULT_TIMEOUTS["other"])
+        else:
+            p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+            learned = p95 * self.multiplier + self.margin
+        return min(cap, max(floor, learned) * backoff)
+
+
+class MongoshProcess:
+    """
+    One mongosh child process and its reader threads. Output from stdout and stderr
+    goes to a queue private to this process, so late lines from a replaced process
+    can never leak into the output of its successor.
+    """
+
+    def __init__(self, command=None):
+        # Only the default command can be tagged; a custom one is run as given
+        self.app_name = None if command else f"mongo-agent-{uuid.uuid4().hex[:12]}"
+        self.process = subprocess.Popen(
+            command or mongosh_command(self.app_name),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding='utf-8',
+            bufsize=1, # Line buffered
+        )
+        self.output_queue = queue.Queue()
+        for pipe in (self.process.stdout, self.process.stderr):
+            threading.Thread(target=self._read_output, args=(pipe,), daemon=True).start()
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
 
     def _read_output(self, pipe):
         """Reads lines from a pipe and puts them into the queue."""
@@ -80,142 +370,447 @@ class MongoExecutor:
             # Handle exceptions during read, e.g., if pipe closes unexpectedly
             logging_manager.log_debug("Executor Read Error", f"Error reading pipe: {e}")
         finally:
-             # Signal that reading from this pipe is done (optional, depends on logic)
-             self.output_queue.put(None) # Use None as a sentinel value if needed
+            self.output_queue.put(None) # Sentinel: this pipe is closed
 
-    def _read_until_prompt(self, timeout=5): # Reducido timeout general a 5s
+    def write(self, text: str):
+        self.process.stdin.write(text)
+        self.process.stdin.flush()
+
+    def send_marker(self, name: str) -> str:
         """
-        Reads from the queue until a prompt pattern (like 'db_name> ') is detected
-        at the end of a line or timeout occurs. Uses regex for robust detection.
+        Sends a print() of a unique marker after whatever was last written to stdin.
+        The marker is built by string concatenation inside mongosh so that an echo of
+        the command itself can never be mistaken for the answer. Returns the marker.
         """
-        output_lines = []
-        start_time = time.time()
-        prompt_found = False
-        # Regex para detectar prompts como 'test> ', 'admin> ', '> ', etc., al final de la línea
-        # Permite nombres de db alfanuméricos y guiones bajos.
-        prompt_re = re.compile(r"^(?:[\w-]+>|>) $") # Busca el patrón al inicio de la línea y que sea toda la línea
+        marker = f"__agent_{name}_{time.monotonic_ns()}__"
+        half = len(marker) // 2
+        self.write(f"print('{marker[:half]}' + '{marker[half:]}')\n")
+        return marker
 
-        # Bucle principal para leer la salida
-        buffer = "" # Acumular líneas parciales si es necesario
-        last_line_read = ""
+    def read_until_marker(self, marker: str, timeout: float):
+        """
+        Collects output lines until the marker line shows up, the timeout expires or
+        the process exits. Prompt fragments ('test> ') glued to the start of lines are
+        stripped. Returns (output, completed).
+        """
+        output_lines = []
+        closed_pipes = 0
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                line = self.output_queue.get(timeout=min(0.2, max(deadline - time.time(), 0.01)))
+            except queue.Empty:
+                continue
+            if line is None: # A pipe closed: stop waiting if the process is gone
+                closed_pipes += 1
+                if closed_pipes == 2 or not self.alive():
+                    logging_manager.log_debug("Executor", "mongosh exited while waiting for output.")
+                    try:
+                        self.process.wait(timeout=1) # Both pipes are closed: reap it so alive() is accurate
+                    except subprocess.TimeoutExpired:
+                        pass
+                    return "".join(output_lines).strip(), False
+                continue
+            if marker in line:
+                return "".join(output_lines).strip(), True
+            output_lines.append(_PROMPT_PREFIX_RE.sub("", line))
+
+        logging_manager.log_debug("Executor Timeout", f"Timeout ({timeout:.1f}s) waiting for end of output.")
+        return "".join(output_lines).strip(), False
+
+    def wait_for_marker(self, name: str, timeout: float = 5) -> bool:
+        """Drains pending output and returns True once mongosh answers a marker."""
+        _, completed = self.read_until_marker(self.send_marker(name), timeout)
+        return completed
+
+    def stop(self, timeout: float = 5):
+        """Terminates the process, killing it if it does not exit in time."""
+        if not self.alive():
+            return
+        try:
+            self.process.terminate() # Try graceful termination
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logging_manager.log_debug("Executor", "mongosh process did not terminate gracefully, killing.")
+            self.kill()
+        except Exception as e:
+            logging_manager.log_debug("Executor Error", f"Error stopping mongosh: {e}")
 
-        while time.time() - start_time < timeout:
+    def kill(self):
+        if self.alive():
+            self.process.kill()
             try:
-                # Usar timeout pequeño para no bloquear mucho, pero permitir que lleguen datos
-                line = self.output_queue.get(timeout=0.2)
-                if line is None: continue # Sentinel
-
-                # Limpiar la línea de posibles caracteres de control ANSI (aunque --quiet debería ayudar)
-                # line_cleaned = re.sub(r'\x1b\[[0-9;]*[mK]', '', line)
-                line_cleaned = line # Asumimos que --quiet elimina la mayoría
-
-                output_lines.append(line_cleaned)
-                last_line_read = line_cleaned.rstrip() # Guardar la última línea sin salto de línea final
-
-                # Usar regex para detectar el prompt al final de la línea
-                # logging_manager.log_debug("Checking line for prompt", f"'{last_line_read}' against regex") # Debug extra
-                if prompt_re.match(last_line_read):
-                    logging_manager.log_debug("Executor", f"Prompt detected: '{last_line_read}'")
-                    prompt_found = True
-                    # Eliminar la línea del prompt de la salida final
-                    output_lines.pop()
-                    break # Salir del bucle while
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                pass
 
-            except queue.Empty:
-                # Si la cola está vacía, puede que el comando haya terminado
-                # pero aún no hemos detectado el prompt. Si ha pasado un tiempo prudencial
-                # sin nueva salida, podríamos asumir que terminó (más arriesgado).
-                # Por ahora, simplemente continuamos esperando hasta el timeout general.
-                if output_lines: # Si ya tenemos algo de salida, esperamos un poco más
-                     pass # Continuar esperando
-                else: # Si no hay salida y la cola está vacía, esperamos
-                     pass
-            except Exception as e:
-                 logging_manager.log_debug("Executor Queue Error", f"Error getting from queue: {e}")
-                 break # Salir en caso de error
 
-        if not prompt_found and time.time() - start_time >= timeout:
-             logging_manager.log_debug("Executor Timeout", f"Timeout ({timeout}s) waiting for prompt. Last line read: '{last_line_read}'")
-             # Devolver lo que se haya podido leer
+class MongoExecutor:
+    """
+    Runs commands in a persistent mongosh shell (one at a time, under `lock`).
+
+    Failure handling:
+      - a monitor thread pings the active shell every `ping_interval` seconds while it
+        is idle, so a dead or hung shell is replaced before the next command needs it;
+      - a standby shell is spawned in the background and kept ready, so replacing the
+        active one (crash, broken pipe, failed ping, timeout) is a swap instead of a
+        cold start while every session waits on the lock;
+      - a swap loses no database context: session databases live here and every
+        command is pinned to its database, so nothing has to be replayed.
+    """
 
-        full_output = "".join(output_lines).strip()
-        # logging_manager.log_debug("Raw output before return", full_output) # Debug
+    def __init__(self, command=None, standby: bool = STANDBY_ENABLED, ping_interval: float = PING_INTERVAL):
+        self.command = command
+        self.use_standby = standby
+        self.ping_interval = ping_interval
+        self.shell = None
+        self.standby = None
+        self.lock = threading.Lock()
+        self.timeouts = TimeoutPolicy()
+        self.single_flight = SingleFlight("mongo.singleflight")
+        self.session_dbs = {} # session_id -> database selected with 'use' in that session
+        self._standby_lock = threading.Lock()
+        self._standby_spawning = False
+        self._stopped = threading.Event()
+        self._monitor = None
+        self._start_process()
+        atexit.register(self._stop_process) # Ensure cleanup on exit
 
-        # Ya no necesitamos la comprobación de ';' porque la detección de prompt debería ser mejor
-        # if full_output.endswith(';'): ...
+    def _spawn(self, role: str = "active") -> MongoshProcess:
+        """Starts a mongosh process and waits until it answers (instead of sleeping a fixed amount)."""
+        logging_manager.log_debug("Executor", f"Starting new mongosh process ({role})...")
+        started = time.perf_counter()
+        try:
+            shell = MongoshProcess(self.command)
+        except Exception as e:
+            logging_manager.log_debug("Executor Error", f"Failed to start mongosh process: {e}")
+            raise RuntimeError(f"Failed to start mongosh process: {e}")
+        if not shell.wait_for_marker("ready", timeout=5):
+            logging_manager.log_debug("Executor", "mongosh did not answer the ready marker in time.")
+            if not shell.alive():
+                raise RuntimeError("mongosh exited during startup")
+        metrics.observe("mongo.spawn", time.perf_counter() - started)
+        logging_manager.log_debug("Executor", f"mongosh process {shell.pid} ({role}) started successfully.")
+        return shell
 
-        return full_output
+    def _start_process(self):
+        if self.shell and self.shell.alive():
+            return # Process already running
+        self.shell = self._spawn()
+        self._ensure_standby()
+        self._start_monitor()
 
+    def _stop_process(self):
+        self._stopped.set()
+        with self._standby_lock:
+            standby, self.standby = self.standby, None
+        for shell in (self.shell, standby):
+            if shell:
+                shell.stop()
+        self.shell = None
+        logging_manager.log_debug("Executor", "mongosh processes stopped.")
+
+    # --- Standby ---
+    def _ensure_standby(self):
+        """Spawns a standby shell in the background unless one is ready or being started."""
+        if not self.use_standby or self._stopped.is_set():
+            return
+        with self._standby_lock:
+            if self._standby_spawning or (self.standby and self.standby.alive()):
+                return
+            self._standby_spawning = True
+        threading.Thread(target=self._spawn_standby, daemon=True).start()
 
-    def execute_command(self, command: str) -> str:
-        """Executes a command in the persistent mongosh process."""
-        with self.lock: # Ensure only one command executes at a time
-            if not self.process or self.process.poll() is not None:
-                logging_manager.log_debug("Executor", "Process not running, attempting restart.")
+    def _spawn_standby(self):
+        try:
+            standby = self._spawn("standby")
+        except RuntimeError:
+            standby = None
+        with self._standby_lock:
+            self._standby_spawning = False
+            if self._stopped.is_set():
+                if standby:
+                    standby.stop()
+                return
+            self.standby = standby
+        metrics.set_gauge("mongo.standby_ready", int(standby is not None))
+
+    def _take_standby(self):
+        """Hands over the standby shell if it is alive (the caller becomes its owner)."""
+        with self._standby_lock:
+            standby, self.standby = self.standby, None
+        metrics.set_gauge("mongo.standby_ready", 0)
+        if standby and standby.alive():
+            return standby
+        if standby:
+            standby.kill()
+        return None
+
+    # --- Failover ---
+    def _failover(self, reason: str):
+        """
+        Replaces the active shell (caller holds `lock`): kills it, swaps in the standby
+        (or cold-starts a new shell if none is ready) and starts a new standby in the
+        background. Raises RuntimeError if no shell can be started.
+        """
+        started = time.perf_counter()
+        metrics.increment("mongo.restarts")
+        metrics.increment(f"mongo.restarts.{reason}")
+        old, self.shell = self.shell, None
+        if old:
+            old.kill()
+
+        shell = self._take_standby()
+        source = "standby" if shell else "cold"
+        metrics.increment(f"mongo.failovers.{source}")
+        if shell is None:
+            shell = self._spawn()
+        self.shell = shell
+        self._ensure_standby()
+
+        elapsed = time.perf_counter() - started
+        metrics.observe("mongo.recovery", elapsed)
+        logging_manager.log_debug("Executor", f"Replaced mongosh ({reason}) with {source} process {shell.pid} in {elapsed * 1000:.0f} ms.")
+
+    def _recycle_process(self):
+        """
+        Replaces the mongosh process after a timeout. The in-flight command may still be
+        running in the old shell and would pollute the next command's output, so the old
+        process is killed and replaced. Killing mongosh does not stop the operation on the
+        server: see _kill_server_operations.
+        """
+        logging_manager.log_debug("Executor", "Recycling mongosh process after timeout.")
+        metrics.increment("mongo.recycles")
+        self._failover("timeout")
+
+    def _kill_server_operations(self, app_name: str) -> int:
+        """
+        Kills, from the active shell, the server operations still running for a replaced
+        shell (found by its appName with currentOp). Returns how many were killed, or -1
+        if they could not be looked up (no privileges, no answer in time).
+        """
+        admin = 'db.getSiblingDB("admin")'
+        script = (f"print('killed:' + {admin}.currentOp({{ appName: {json.dumps(app_name)} }})"
+                  f".inprog.map(op => {admin}.killOp(op.opid)).length)")
+        try:
+            self.shell.write(script + "\n")
+            output, completed = self.shell.read_until_marker(self.shell.send_marker("kill"), PING_TIMEOUT)
+        except OSError:
+            return -1
+        killed = _KILLED_RE.search(output)
+        if not completed or not killed:
+            logging_manager.log_debug("Executor Error", f"Could not kill the operations of {app_name}: {output}")
+            return -1
+        metrics.increment("mongo.killed_operations", int(killed.group(1)))
+        return int(killed.group(1))
+
+    def _timeout_error(self, cls: str, timeout: float, app_name: str, bounded: bool) -> str:
+        """
+        Recycles the shell after a timeout and tells the model what happened to the command
+        on the server. Only find/aggregate carry maxTimeMS, so anything else is killed with
+        killOp; if that is not possible the model is warned that it may still be running,
+        so that it does not blindly retry (and apply twice) a write.
+        """
+        self._recycle_process()
+        killed = -1 if bounded or not app_name else self._kill_server_operations(app_name)
+        if bounded:
+            state = "was cancelled"
+        elif killed > 0:
+            state = "was stopped on the server"
+        elif killed == 0:
+            state = "is no longer running on the server"
+        else:
+            state = "may still be running on the server"
+        message = f"Error: Command timed out after {timeout:.1f}s and {state}."
+        if not bounded and cls not in ("find", "aggregate", "count", "shell"):
+            message += " It may have been partly applied: check the data before retrying it."
+        return message
+
+    def _crashed(self, output: str) -> str:
+        """The shell died after receiving the command: it may have partly run, so it is not resent."""
+        metrics.increment("mongo.crashes")
+        error = "Error: mongosh process terminated while running the command."
+        try:
+            self._failover("crash")
+        except RuntimeError as e:
+            logging_manager.log_debug("Executor Error", f"Failover after crash did not succeed: {e}")
+        return f"{output}\n{error}" if output else error
+
+    # --- Liveness ---
+    def _start_monitor(self):
+        if self._monitor or not self.ping_interval:
+            return
+        self._monitor = threading.Thread(target=self._monitor_loop, daemon=True, name="mongosh-monitor")
+        self._monitor.start()
+
+    def _monitor_loop(self):
+        while not self._stopped.wait(self.ping_interval):
+            self.ping()
+
+    def ping(self) -> bool:
+        """
+        Liveness check of the active shell; replaces it if it is dead or does not answer
+        within PING_TIMEOUT. Skipped while a command is running (the command notices
+        failures itself). Also restarts the standby if it died.
+        """
+        if not self.lock.acquire(blocking=False):
+            return True
+        try:
+            metrics.increment("mongo.pings")
+            try:
+                healthy = self.shell is not None and self.shell.alive() and self.shell.wait_for_marker("ping", PING_TIMEOUT)
+            except OSError:
+                healthy = False
+            if not healthy:
+                metrics.increment("mongo.ping_failures")
                 try:
-                    self._start_process()
+                    self._failover("ping")
                 except RuntimeError as e:
-                    return f"Error: Could not start or restart mongosh process. {e}"
+                    logging_manager.log_debug("Executor Error", f"Failover after failed ping did not succeed: {e}")
+            return healthy
+        finally:
+            self.lock.release()
+            self._ensure_standby()
+
+    def health_check(self, timeout=5) -> bool:
+        """Checks that the mongosh process is alive and answering commands."""
+        with self.lock:
+            if not self.shell or not self.shell.alive():
+                return False
+            try:
+                return self.shell.wait_for_marker("health", timeout=timeout)
+            except OSError as e:
+                logging_manager.log_debug("Executor Error", f"Health check failed: {e}")
+                return False
 
-            if not self.process:
-                 return "Error: mongosh process is not available."
+    def current_database(self, session_id: str = None) -> str:
+        """Database the session's commands run against."""
+        return self.session_dbs.get(session_id or DEFAULT_SESSION, DEFAULT_DATABASE)
 
-            logging_manager.log_debug("Executor Input", command)
+    def execute_command(self, command: str, session_id: str = None, database: str = None) -> str:
+        """
+        Executes a command in the persistent mongosh process on behalf of a session.
+
+        The shell is shared, so 'use' never reaches it: it only updates the session's
+        database (no round-trip), and every command is pinned to that database with
+        getSiblingDB. A 'use <db>;' prefix or an explicit `database` switches the session
+        and runs the command there in a single call. Identical read-only commands on the
+        same database that arrive while one is already in flight share its result
+        instead of queueing behind the lock again.
+        """
+        session_id = session_id or DEFAULT_SESSION
+        use_db, rest = split_use(command)
+        database = use_db or database
+        if database:
+            if not is_valid_database_name(database):
+                return f"Error: invalid database name {database!r} (allowed: letters, digits, '_' and '-')"
+            if self.session_dbs.get(session_id) != database:
+                logging_manager.log_debug("Executor", f"Session {session_id} switched to db {database}")
+            self.session_dbs[session_id] = database
+        if use_db and not rest:
+            metrics.increment("mongo.use_local")
+            return f"switched to db {database}"
+
+        target = self.current_database(session_id)
+        try:
+            pinned = pin_to_database(rest, target)
+        except ValueError as e:
+            return f"Error: {e}"
+        if is_coalescable(rest):
+            key = (target, normalize_command(rest))
+            return self.single_flight.do(key, lambda: self._execute(pinned))
+        return self._execute(pinned)
+
+    def _execute(self, command: str) -> str:
+        with self.lock: # Ensure only one command executes at a time
             try:
-                # Send command, ensuring newline
-                self.process.stdin.write(command + '\n')
-                self.process.stdin.flush()
-
-                # Read output until the next prompt appears
-                output = self._read_until_prompt(timeout=1) # Increased timeout for potentially long commands
+                if not self.shell or not self.shell.alive():
+                    logging_manager.log_debug("Executor", "Process not running, failing over.")
+                    self._failover("dead")
+            except RuntimeError as e:
+                return f"Error: Could not start or restart mongosh process. {e}"
+
+            cls = command_class(command)
+            timeout = self.timeouts.timeout_for(cls)
+            # The server gets slightly less time than we wait, so that it normally reports
+            # MaxTimeMSExpired itself and the channel stays in sync without a recycle.
+            to_send = with_max_time(command, int(timeout * 900))
+            logging_manager.log_debug("Executor Input", f"{to_send} (class={cls}, timeout={timeout:.1f}s)")
+            try:
+                started = time.perf_counter()
+                try:
+                    self.shell.write(to_send + '\n')
+                except OSError:
+                    # The command never reached the shell, so it is safe to send it to the replacement
+                    logging_manager.log_debug("Executor Error", "Broken pipe: mongosh process likely terminated, failing over.")
+                    self._failover("broken_pipe")
+                    started = time.perf_counter()
+                    self.shell.write(to_send + '\n')
+                marker = self.shell.send_marker("end")
+
+                output, completed = self.shell.read_until_marker(marker, timeout)
+                elapsed = time.perf_counter() - started
                 logging_manager.log_debug("Executor Output", output)
 
+                if not completed and not self.shell.alive():
+                    return self._crashed(output)
+
+                if not completed:
+                    metrics.increment("mongo.timeouts")
+                    metrics.increment(f"mongo.timeouts.{cls}")
+                    self.timeouts.record_timeout(cls, timeout)
+                    error = self._timeout_error(cls, timeout, self.shell.app_name, bounded=to_send != command)
+                    return f"{output}\n{error}" if output else error
+
+                self.timeouts.record(cls, elapsed)
+                metrics.observe(f"mongo.command.{cls}", elapsed)
+
                 # Basic check for common errors in stderr output (might need refinement)
                 if "SyntaxError:" in output or "ReferenceError:" in output or "MongoServerError:" in output:
                      logging_manager.log_debug("Executor Error Detected", output)
                      # Consider how to report errors vs normal output
 
-                # Update prompt pattern based on output if needed (e.g., after 'use db')
-                lines = output.splitlines()
-                if lines:
-                    last_line = lines[-1]
-                    if last_line.endswith('>'):
-                         # Simplistic update, assumes last line contains the new prompt
-                         # Might need regex `r"(\w+)> $"`
-                         potential_prompt = last_line.strip()
-                         if potential_prompt != self.prompt_pattern.strip():
-                              self.prompt_pattern = potential_prompt + " " # Add space back
-                              logging_manager.log_debug("Executor", f"Prompt updated to: '{self.prompt_pattern}'")
-
-
                 return output
 
-            except BrokenPipeError:
-                 logging_manager.log_debug("Executor Error", "Broken pipe: mongosh process likely terminated.")
-                 self.process = None # Mark process as dead
-                 return "Error: mongosh process terminated unexpectedly."
+            except OSError as e:
+                logging_manager.log_debug("Executor Error", f"Broken pipe after sending the command: {e}")
+                return self._crashed("")
             except Exception as e:
                 logging_manager.log_debug("Executor Exception", f"Error during command execution: {e}")
-                # Attempt to stop/restart the process on error?
-                # self._stop_process()
                 return f"Error executing command: {e}"
 
+# Session used by callers that don't pass one (e.g. the console)
+DEFAULT_SESSION = "default"
+# Database of a session that has not selected one yet (mongosh's own default)
+DEFAULT_DATABASE = os.getenv("MONGO_DEFAULT_DB", "test")
+
 # Global instance
 _mongo_executor_instance = None
+_instance_lock = threading.Lock() # The warm-up and /chat worker threads may race to create it
 
 def get_executor_instance():
     """Gets the singleton instance of MongoExecutor."""
     global _mongo_executor_instance
     if _mongo_executor_instance is None:
-        _mongo_executor_instance = MongoExecutor()
+        with _instance_lock:
+            if _mongo_executor_instance is None:
+                _mongo_executor_instance = MongoExecutor()
     return _mongo_executor_instance
 
-def execute_mongo_command(command: str) -> str:
+def warm_up() -> bool:
+    """
+    Pre-spawns the singleton mongosh process and health-checks it, so the first
+    real command does not pay for the process start.
+    """
+    return get_executor_instance().health_check()
+
+def execute_mongo_command(command: str, session_id: str = None, database: str = None) -> str:
     """
-    Public function to execute a command using the singleton executor instance.
+    Public function to execute a command using the singleton executor instance,
+    in the database context of `session_id` (see MongoExecutor.execute_command).
     """
     executor_instance = get_executor_instance()
-    return executor_instance.execute_command(command)
+    return executor_instance.execute_command(command, session_id=session_id, database=database)
 
 # Example of how to ensure cleanup (already handled by atexit)
 # def cleanup():
@@ -0,0 +1,249 @@
+# ingest.py
+import codecs
+import csv
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+import logging_manager
+import metrics
+from executor import MONGO_URI # El mismo servidor al que se conecta mongosh
+
+FORMAT_JSONL = "jsonl"
+FORMAT_CSV = "csv"
+FORMATS = (FORMAT_JSONL, FORMAT_CSV)
+
+DEFAULT_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1000"))
+MAX_BATCH_SIZE = 10_000
+MAX_REPORTED_ERRORS = 20
+
+# Literal decimal sin ceros a la izquierda; los grupos 1 y 2 (decimales, exponente) lo hacen float
+_NUMBER_RE = re.compile(r"-?(?:0|[1-9][0-9]*)(\.[0-9]+)?([eE][+-]?[0-9]+)?")
+
+# (lote, ordered) -> (documentos insertados, mensajes de error)
+BatchWriter = Callable[[List[dict], bool], Tuple[int, List[str]]]
+
+
+class IngestError(Exception):
+    """La carga no se puede procesar (formato desconocido, línea ilegible...)."""
+
+
+@dataclass
+class IngestProgress:
+    """Estado de una carga masiva: se actualiza lote a lote y se expone por la API."""
+    database: str
+    collection: str
+    format: str
+    ordered: bool
+    batch_size: int
+    status: str = "running" # "running", "completed" o "failed"
+    received: int = 0 # Documentos leídos del cuerpo de la petición
+    inserted: int = 0
+    failed: int = 0
+    batches: int = 0
+    errors: List[str] = field(default_factory=list)
+    started: float = field(default_factory=time.monotonic)
+    finished: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        """Documentos insertados por segundo."""
+        return self.inserted / self.elapsed if self.elapsed > 0 else 0.0
+
+    def add_errors(self, errors: List[str]):
+        self.errors.extend(errors[:MAX_REPORTED_ERRORS - len(self.errors)])
+
+    def summary(self) -> str:
+        """Resumen en una línea, el que se añade al historial de la sesión."""
+        text = (
+            f"Carga masiva ({self.format}) en {self.database}.{self.collection}: "
+            f"{self.inserted} documentos insertados de {self.received} recibidos"
+        )
+        if self.failed:
+            text += f", {self.failed} con error"
+        return text + f" ({self.status}, {self.elapsed:.1f}s)."
+
+    def to_dict(self) -> dict:
+        return {
+            "database": self.database,
+            "collection": self.collection,
+            "format": self.format,
+            "ordered": self.ordered,
+            "batch_size": self.batch_size,
+            "status": self.status,
+            "received": self.received,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "batches": self.batches,
+            "errors": self.errors,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "docs_per_second": round(self.throughput, 1),
+        }
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Convierte los trozos del cuerpo (bytes) en líneas de texto sin cargarlo entero en memoria."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+def _coerce(value: str):
+    """
+    Valores de CSV: booleanos y números decimales "limpios" a su tipo; el resto se queda como
+    texto. No se convierten códigos con ceros a la izquierda ("007"), separadores ("1_000"),
+    espacios ni "NaN"/"Infinity", que int()/float() sí aceptarían cambiando el dato.
+    """
+    if value in ("true", "false"):
+        return value == "true"
+    match = _NUMBER_RE.fullmatch(value)
+    if match is None:
+        return value
+    return float(value) if match.group(1) or match.group(2) else int(value)
+
+
+async def iter_documents(lines: AsyncIterator[str], fmt: str) -> AsyncIterator[dict]:
+    """Documentos de una carga JSON-lines (un objeto por línea) o CSV (con cabecera)."""
+    if fmt not in FORMATS:
+        raise IngestError(f"Unsupported format '{fmt}' (expected one of {', '.join(FORMATS)})")
+
+    if fmt == FORMAT_JSONL:
+        line_number = 0
+        async for line in lines:
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                document = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise IngestError(f"Line {line_number}: invalid JSON ({e.msg})")
+            if not isinstance(document, dict):
+                raise IngestError(f"Line {line_number}: expected a JSON object")
+            yield document
+        return
+
+    header = None
+    record = ""
+    async for line in lines:
+        # Un campo entre comillas puede contener saltos de línea: se acumula hasta cerrar las comillas
+        record = f"{record}\n{line}" if record else line
+        if record.count('"') % 2:
+            continue
+        if not record.strip():
+            record = ""
+            continue
+        row = next(csv.reader([record]))
+        record = ""
+        if header is None:
+            header = row
+            continue
+        yield {name: _coerce(value) for name, value in zip(header, row) if value != ""}
+    if record:
+        raise IngestError("Unterminated quoted field at end of CSV")
+
+
+async def ingest(documents: AsyncIterator[dict], write_batch: BatchWriter, progress: IngestProgress, run_blocking=None) -> IngestProgress:
+    """
+    Agrupa los documentos en lotes de `progress.batch_size` y los escribe con `write_batch`.
+    Cada escritura (bloqueante) se hace con `run_blocking` (p. ej. asyncio.to_thread) para no
+    parar el bucle de eventos mientras se sigue leyendo el cuerpo. En modo ordenado la carga
+    se detiene en el primer lote con errores; en modo no ordenado continúa.
+    """
+    async def flush(batch):
+        started = time.perf_counter()
+        if run_blocking:
+            inserted, errors = await run_blocking(write_batch, batch, progress.ordered)
+        else:
+            inserted, errors = write_batch(batch, progress.ordered)
+        metrics.observe("ingest.batch", time.perf_counter() - started)
+        metrics.increment("ingest.documents", inserted)
+        progress.batches += 1
+        progress.inserted += inserted
+        progress.failed += len(batch) - inserted
+        progress.add_errors(errors)
+        return not (errors and progress.ordered)
+
+    batch = []
+    try:
+        async for document in documents:
+            progress.received += 1
+            batch.append(document)
+            if len(batch) >= progress.batch_size:
+                keep_going = await flush(batch)
+                batch = []
+                if not keep_going:
+                    break
+        else:
+            if batch:
+                await flush(batch)
+        progress.status = "failed" if progress.failed and progress.ordered else "completed"
+    except IngestError as e:
+        progress.status = "failed"
+        progress.add_errors([str(e)])
+    finally:
+        progress.finished = time.monotonic()
+        if progress.status == "running": # Cancelada o error inesperado
+            progress.status = "failed"
+        logging_manager.log_debug("Ingest", progress.summary())
+    return progress
+
+
+# --- Escritura en MongoDB con pymongo ---
+# La carga no pasa por mongosh: un insert_many por lote sobre una conexión directa
+# al mismo MONGO_URI que usa el shell.
+_client = None
+_client_lock = threading.Lock()
+
+
+def _get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            from pymongo import MongoClient # Import diferido: solo lo necesita la carga masiva
+            _client = MongoClient(MONGO_URI)
+        return _client
+
+
+def is_valid_collection_name(collection: str) -> bool:
+    """Nombre de colección que MongoDB acepta como destino de una carga (no vacío, sin '$' ni NUL, no system.*)."""
+    return (0 < len(collection) <= 255 and "$" not in collection and "\0" not in collection
+            and not collection.startswith(("system.", ".")) and not collection.endswith("."))
+
+
+def mongo_writer(database: str, collection: str) -> BatchWriter:
+    """
+    BatchWriter que inserta cada lote con insert_many en `database.collection`.
+    Lanza IngestError si pymongo rechaza el nombre de la base de datos o de la colección.
+    """
+    from pymongo.errors import BulkWriteError, InvalidName
+
+    try:
+        target = _get_client()[database][collection]
+    except InvalidName as e:
+        raise IngestError(f"Invalid target {database}.{collection}: {e}")
+
+    def write_batch(batch: List[dict], ordered: bool) -> Tuple[int, List[str]]:
+        try:
+            result = target.insert_many(batch, ordered=ordered)
+            return len(result.inserted_ids), []
+        except BulkWriteError as e:
+            details = e.details
+            errors = [f"Document {error.get('index')}: {error.get('errmsg')}" for error in details.get("writeErrors", [])]
+            return details.get("nInserted", 0), errors
+
+    return write_batch
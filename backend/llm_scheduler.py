@@ -0,0 +1,215 @@
+# llm_scheduler.py
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import logging_manager
+import metrics
+
+# Prioridades (menor = antes). Terminar una tarea de varios pasos ya empezada
+# tiene preferencia sobre empezar una petición nueva.
+PRIORITY_CONTINUATION = 0
+PRIORITY_NEW = 1
+
+MAX_RATE_LIMIT_RETRIES = 5
+DEFAULT_RETRY_AFTER = 5.0
+
+_current_priority = contextvars.ContextVar("llm_priority", default=PRIORITY_NEW)
+
+
+@contextmanager
+def task_priority(priority: int):
+    """Fija la prioridad de las llamadas al LLM hechas dentro del bloque (en este hilo/contexto)."""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class RateLimited(Exception):
+    """El servidor rechazó la petición por cuota (HTTP 429)."""
+
+    def __init__(self, retry_after: float = DEFAULT_RETRY_AFTER):
+        super().__init__(f"Rate limited, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Cubo de tokens: `capacity` como ráfaga máxima y recarga continua de `capacity` por `window` segundos."""
+
+    def __init__(self, capacity: float, window: float = 60.0, clock=time.monotonic):
+        self.capacity = capacity
+        self.rate = capacity / window
+        self.clock = clock
+        self.level = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        """Segundos hasta que haya `amount` disponibles (0 si ya los hay)."""
+        self._refill()
+        amount = min(amount, self.capacity) # Una petición mayor que el cubo entero pasa cuando esté lleno
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def consume(self, amount: float):
+        """Retira `amount` (el nivel puede quedar negativo: deuda que se paga con la recarga)."""
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+    def available(self) -> float:
+        self._refill()
+        return self.level
+
+
+class RateLimitScheduler:
+    """
+    Planificador de peticiones al LLM que respeta las cuotas por minuto del proveedor:
+      - un cubo de peticiones (RPM) y otro de tokens estimados (TPM);
+      - las peticiones esperan en una cola por prioridad (y orden de llegada) en lugar
+        de dispararse y recibir un 429;
+      - si aun así el servidor responde 429, se bloquea el cubo durante Retry-After
+        y la petición se vuelve a encolar con prioridad de continuación;
+      - como mucho `max_concurrent` peticiones en curso a la vez. El límite se aplica
+        aquí, en la misma cola por prioridad, para que una continuación adelante a las
+        peticiones nuevas también cuando lo que escasea son las llamadas simultáneas.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, window: float = 60.0, name: str = "llm.scheduler",
+                 max_concurrent: int = None):
+        self.name = name
+        self.max_concurrent = max_concurrent # None: sin límite
+        self._active = 0
+        self.requests = TokenBucket(requests_per_minute, window)
+        self.tokens = TokenBucket(tokens_per_minute, window)
+        self._cond = threading.Condition()
+        self._queue = [] # heap de (prioridad, secuencia)
+        self._sequence = itertools.count()
+        self._blocked_until = 0.0
+
+    def _wait_time(self, estimated_tokens: float) -> float:
+        blocked = max(0.0, self._blocked_until - time.monotonic())
+        return max(blocked, self.requests.time_until(1), self.tokens.time_until(estimated_tokens))
+
+    def acquire(self, estimated_tokens: float, priority: int = None):
+        """
+        Bloquea hasta que esta petición sea la primera de la cola, haya presupuesto y un hueco
+        de concurrencia; entonces consume el presupuesto y ocupa el hueco (liberarlo con release()).
+        """
+        priority = _current_priority.get() if priority is None else priority
+        entry = (priority, next(self._sequence))
+        queued_at = time.perf_counter()
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            self._publish()
+            try:
+                while True:
+                    timeout = None
+                    if self._queue[0] == entry and not self._saturated():
+                        timeout = self._wait_time(estimated_tokens)
+                        if timeout <= 0:
+                            heapq.heappop(self._queue)
+                            self.requests.consume(1)
+                            self.tokens.consume(estimated_tokens)
+                            self._active += 1
+                            break
+                    self._cond.wait(timeout=timeout)
+            except BaseException:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                raise
+            finally:
+                self._publish()
+                self._cond.notify_all()
+        metrics.observe(f"{self.name}.wait", time.perf_counter() - queued_at)
+        metrics.increment(f"{self.name}.requests")
+
+    def _saturated(self) -> bool:
+        return self.max_concurrent is not None and self._active >= self.max_concurrent
+
+    def release(self):
+        """La petición obtenida con acquire() terminó: libera su hueco de concurrencia."""
+        with self._cond:
+            self._active -= 1
+            self._publish()
+            self._cond.notify_all()
+
+    def record_usage(self, estimated_tokens: float, actual_tokens: float):
+        """Corrige el cubo de tokens con el consumo real informado por la API."""
+        with self._cond:
+            self.tokens.consume(actual_tokens - estimated_tokens)
+            self._publish()
+        metrics.increment(f"{self.name}.tokens", int(actual_tokens))
+
+    def penalize(self, retry_after: float):
+        """El servidor devolvió 429: nadie sale de la cola hasta que pase `retry_after`."""
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+            self._cond.notify_all()
+        metrics.increment(f"{self.name}.rate_limited")
+        logging_manager.log_debug("LLM Scheduler", f"Rate limited by server, pausing for {retry_after}s")
+
+    def submit(self, send, estimated_tokens: float, priority: int = None, max_retries: int = MAX_RATE_LIMIT_RETRIES):
+        """
+        Ejecuta `send()` cuando el presupuesto lo permite. `send` debe devolver
+        (resultado, tokens_reales) o lanzar RateLimited si el servidor respondió 429;
+        en ese caso la petición se reencola (con prioridad de continuación) en vez de fallar.
+        """
+        priority = _current_priority.get() if priority is None else priority
+        for attempt in range(max_retries + 1):
+            self.acquire(estimated_tokens, priority)
+            try:
+                result, actual_tokens = send()
+            except RateLimited as e:
+                self.penalize(e.retry_after)
+                priority = PRIORITY_CONTINUATION
+                if attempt == max_retries:
+                    raise
+                continue
+            finally:
+                self.release()
+            if actual_tokens is not None:
+                self.record_usage(estimated_tokens, actual_tokens)
+            return result
+
+    def usage(self) -> dict:
+        """Presupuesto disponible y ocupación de la cola."""
+        with self._cond:
+            return self._usage()
+
+    def _usage(self) -> dict:
+        return {
+            "requests_per_minute": self.requests.capacity,
+            "tokens_per_minute": self.tokens.capacity,
+            "requests_available": round(self.requests.available(), 2),
+            "tokens_available": round(self.tokens.available(), 1),
+            "queued": len(self._queue),
+            "active": self._active,
+            "max_concurrent": self.max_concurrent,
+            "blocked_for_seconds": round(max(0.0, self._blocked_until - time.monotonic()), 2),
+        }
+
+    def _publish(self):
+        for key, value in self._usage().items():
+            metrics.set_gauge(f"{self.name}.{key}", value)
+
+
+def estimate_tokens(text: str, max_output_tokens: int = 0) -> int:
+    """Estimación barata de tokens (~4 caracteres por token) más la salida máxima reservada."""
+    return len(text) // 4 + max_output_tokens
+
+
+# Planificador compartido para la API de Gemini (cuotas y concurrencia configurables por entorno)
+gemini_scheduler = RateLimitScheduler(
+    requests_per_minute=float(os.getenv("GEMINI_RPM", "15")),
+    tokens_per_minute=float(os.getenv("GEMINI_TPM", "1000000")),
+    max_concurrent=int(os.getenv("LLM_MAX_CONCURRENCY", "4")),
+)
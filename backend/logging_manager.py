@@ -42,10 +42,15 @@ def print_log():
     """Indica la ubicación del archivo de log."""
     print(f"El log completo se encuentra en: {os.path.abspath(LOG_FILE)}")
 
-# Limpiar el log al inicio de cada ejecución.
-try:
-    if os.path.exists(LOG_FILE):
-        os.remove(LOG_FILE)
-        print(f"Log anterior ({LOG_FILE}) eliminado.") # Mensaje informativo
-except Exception as e:
-    print(f"Advertencia: No se pudo limpiar el log anterior ({LOG_FILE}): {e}")
+def reset_log():
+    """
+    Limpia el log al inicio de cada ejecución.
+    Se llama explícitamente desde los puntos de entrada (main.py, api_server.py) en lugar de
+    hacerlo al importar el módulo, para que importar no tenga efectos secundarios en disco.
+    """
+    try:
+        if os.path.exists(LOG_FILE):
+            os.remove(LOG_FILE)
+            print(f"Log anterior ({LOG_FILE}) eliminado.") # Mensaje informativo
+    except Exception as e:
+        print(f"Advertencia: No se pudo limpiar el log anterior ({LOG_FILE}): {e}")
@@ -0,0 +1,61 @@
+# metrics.py
+import threading
+from collections import defaultdict
+
+# Métricas en memoria del proceso: contadores, valores instantáneos (gauges) y tiempos.
+# Son seguras entre hilos y se exponen en /metrics (api_server.py).
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_timings = {} # nombre -> [n, total_segundos, max_segundos]
+
+
+def increment(name: str, value: int = 1):
+    """Suma `value` al contador `name`."""
+    with _lock:
+        _counters[name] += value
+
+
+def set_gauge(name: str, value):
+    """Fija el valor instantáneo `name`."""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, seconds: float):
+    """Registra una duración para `name` (se acumulan número, total y máximo)."""
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            _timings[name] = [1, seconds, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+
+def get_counter(name: str) -> int:
+    """Valor actual del contador `name`."""
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot() -> dict:
+    """Copia serializable de todas las métricas."""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "timings": {
+                name: {"count": n, "avg_seconds": round(total / n, 6), "max_seconds": round(peak, 6)}
+                for name, (n, total, peak) in _timings.items()
+            },
+        }
+
+
+def reset():
+    """Borra todas las métricas (útil en pruebas)."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timings.clear()
@@ -8,16 +8,27 @@ import requests
 from dotenv import load_dotenv
 from langchain.llms.base import LLM
 
+import communication
+import llm_scheduler
 import logging_manager  # Importar para usar log_debug
+import model_router
 
 load_dotenv()  # Carga las variables de entorno
 API_KEY = os.getenv("GEMINI_API_KEY")
 
+# Sesión HTTP compartida: reutiliza la conexión TLS (keep-alive) entre llamadas
+# en lugar de abrir una conexión nueva en cada requests.post.
+_http_session = requests.Session()
+
 class GeminiLLM(LLM):
     model_name: str = "gemini-2.0-flash-001"
     api_key: str = API_KEY
-    # Suponemos un endpoint para la API de Gemini; ajústalo según la documentación real.
-    endpoint: str = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-001:generateContent"
+    # Base de la API; el modelo de cada llamada lo elige model_router según el tipo de paso.
+    # GEMINI_API_BASE permite apuntar a un servidor local (stub_gemini.py) para pruebas.
+    api_base: str = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta/models")
+    # "json": salida estructurada con communication.RESPONSE_SCHEMA (por defecto).
+    # "text": protocolo de texto 'etiqueta: contenido' (modo anterior).
+    response_mode: str = os.getenv("GEMINI_RESPONSE_MODE", "json")
 
     @property
     def _llm_type(self) -> str:
@@ -29,39 +40,85 @@ class GeminiLLM(LLM):
         return {"model_name": self.model_name}
 
     def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
-        headers = {
-            "Content-Type": "application/json"
-        }
         # Add warning about user's potential lack of DB knowledge
         warning = "Advertencia: El usuario puede no tener conocimientos de bases de datos. Responde de forma clara y sencilla, explicando los conceptos si es necesario.\n\n"
         modified_prompt = warning + prompt
+        logging_manager.log_debug("Prompt Enviado", modified_prompt) # Log modified prompt
+
+        # The router picks model and generation settings for the current step type
+        # (tool / final / retry) and escalates when a rule asks for it.
+        raw_text = model_router.gemini_router.call(lambda route: self._generate(modified_prompt, route))
+        logging_manager.log_debug("Respuesta Cruda Modelo", raw_text) # Log raw response
+
+        # In JSON mode communication.parse_model_output is the only parser (it also repairs
+        # fenced or wrapped JSON); the regex cleanup below is only for the text protocol.
+        if self.response_mode == "json":
+            return raw_text
+
+        # Clean and parse the response
+        cleaned_text = self._clean_and_parse_response(raw_text)
+        logging_manager.log_debug("Respuesta Limpia Modelo", cleaned_text) # Log cleaned response
+        return cleaned_text
+
+    def complete(self, prompt: str) -> str:
+        """
+        Llamada directa al modelo, sin pasar por la maquinaria de callbacks de Langchain.
+        Es el backend LLM que usa agent.AgentEngine.
+        """
+        return self._call(prompt)
 
+    def _generate(self, prompt: str, route: model_router.Route) -> model_router.Outcome:
+        """Una llamada a generateContent con el modelo y los parámetros de `route`."""
+        headers = {
+            "Content-Type": "application/json"
+        }
         data = {
             "contents": [{
                 "parts": [{
-                    "text": modified_prompt # Use the modified prompt here
+                    "text": prompt
                 }]
             }],
             "generationConfig": {
-                "maxOutputTokens": 512
+                "maxOutputTokens": route.max_output_tokens,
+                "temperature": route.temperature,
             }
         }
+        if self.response_mode == "json":
+            data["generationConfig"]["responseMimeType"] = "application/json"
+            data["generationConfig"]["responseSchema"] = communication.RESPONSE_SCHEMA
         params = {
             "key": self.api_key
         }
-        logging_manager.log_debug("Prompt Enviado", modified_prompt) # Log modified prompt
-        response = requests.post(self.endpoint, headers=headers, json=data, params=params)
-        response.raise_for_status()
-        result = response.json()
+        endpoint = f"{self.api_base}/{route.model}:generateContent"
+
+        def send():
+            response = _http_session.post(endpoint, headers=headers, json=data, params=params)
+            if response.status_code == 429:
+                raise llm_scheduler.RateLimited(_retry_after(response))
+            response.raise_for_status()
+            result = response.json()
+            return result, result.get("usageMetadata", {}).get("totalTokenCount")
+
+        # The scheduler queues the call until the per-minute budget allows it and
+        # re-queues it on a 429 instead of surfacing the error to the user.
+        estimated_tokens = llm_scheduler.estimate_tokens(prompt, route.max_output_tokens)
+        result = llm_scheduler.gemini_scheduler.submit(send, estimated_tokens)
 
         # Extract the raw text response
-        raw_text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "").strip()
-        logging_manager.log_debug("Respuesta Cruda Modelo", raw_text) # Log raw response
+        candidate = result.get("candidates", [{}])[0]
+        raw_text = candidate.get("content", {}).get("parts", [{}])[0].get("text", "").strip()
+        return model_router.Outcome(text=raw_text, finish_reason=candidate.get("finishReason"))
 
-        # Clean and parse the response
-        cleaned_text = self._clean_and_parse_response(raw_text)
-        logging_manager.log_debug("Respuesta Limpia Modelo", cleaned_text) # Log cleaned response
-        return cleaned_text
+    def warm_up(self, timeout: float = 10) -> bool:
+        """
+        Abre la conexión con la API de Gemini por adelantado (consulta los metadatos del
+        modelo, que no consume cuota de generación) para que la primera llamada real
+        no pague el handshake TCP/TLS.
+        """
+        model_url = f"{self.api_base}/{model_router.gemini_router.route_for(model_router.STEP_TOOL).model}"
+        response = _http_session.get(model_url, params={"key": self.api_key}, timeout=timeout)
+        logging_manager.log_debug("LLM Warm-up", f"GET {model_url} -> {response.status_code}")
+        return response.ok
 
     def _clean_and_parse_response(self, raw_text: str) -> str:
         """
@@ -109,5 +166,25 @@ class GeminiLLM(LLM):
             else:
                 return f"respuesta usuario: {text_no_fences}"
 
+def _retry_after(response) -> float:
+    """
+    Segundos a esperar tras un 429: cabecera Retry-After o, en la API de Gemini,
+    el campo retryDelay (p. ej. "13s") de los detalles del error.
+    """
+    header = response.headers.get("Retry-After")
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+    try:
+        for detail in response.json().get("error", {}).get("details", []):
+            delay = detail.get("retryDelay")
+            if delay:
+                return float(delay.rstrip("s"))
+    except ValueError:
+        pass
+    return llm_scheduler.DEFAULT_RETRY_AFTER
+
 # La función get_model_response ya no es necesaria,
 # Langchain ConversationChain se encarga de la interacción con el LLM.
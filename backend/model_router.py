@@ -0,0 +1,171 @@
+# model_router.py
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, List, NamedTuple, Optional
+
+import llm_scheduler
+import logging_manager
+import metrics
+
+# Tipos de paso del agente
+STEP_TOOL = "tool" # Paso intermedio: se espera una `consulta mongo` corta, prima la latencia
+STEP_FINAL = "final" # Más espacio para la respuesta al usuario: se llega escalando una salida truncada
+STEP_RETRY = "retry" # Reintento tras una respuesta ilegible o un error de mongo
+
+_current_step = contextvars.ContextVar("llm_step", default=STEP_TOOL)
+
+
+@contextmanager
+def step_type(step: str):
+    """Fija el tipo de paso de las llamadas al LLM hechas dentro del bloque."""
+    token = _current_step.set(step)
+    try:
+        yield
+    finally:
+        _current_step.reset(token)
+
+
+def current_step() -> str:
+    return _current_step.get()
+
+
+@dataclass(frozen=True)
+class Route:
+    """Modelo y parámetros de generación para un tipo de paso."""
+    name: str
+    model: str
+    max_output_tokens: int
+    temperature: float
+
+
+class Outcome(NamedTuple):
+    """Lo que devuelve el backend para una ruta: texto, motivo de fin y error (si lo hubo)."""
+    text: str = ""
+    finish_reason: Optional[str] = None
+    error: Optional[Exception] = None
+
+
+# Regla de escalado: (ruta usada, resultado) -> nombre de la ruta a la que escalar, o None
+EscalationRule = Callable[[Route, Outcome], Optional[str]]
+
+
+def escalate_truncated_output(route: Route, outcome: Outcome) -> Optional[str]:
+    """Si la salida se cortó por el límite de tokens, repetir con la ruta de respuesta final (más tokens)."""
+    if outcome.error is None and outcome.finish_reason == "MAX_TOKENS" and route.name != STEP_FINAL:
+        return STEP_FINAL
+    return None
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    """Código HTTP de un error de requests (error.response) o de urllib (error.code), si lo tiene."""
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) or getattr(error, "code", None)
+
+
+def escalate_failed_call(route: Route, outcome: Outcome) -> Optional[str]:
+    """
+    Si el modelo rápido falla (5xx, sobrecarga...), repetir con el modelo de reintento.
+    No se escala un 4xx (la petición misma es inválida y fallaría igual) ni un RateLimited
+    que el planificador ya dejó de reintentar: la cuota es compartida y escalar solo
+    gastaría otra llamada.
+    """
+    if outcome.error is None or route.name == STEP_RETRY:
+        return None
+    if isinstance(outcome.error, llm_scheduler.RateLimited):
+        return None
+    status = _status_code(outcome.error)
+    if isinstance(status, int) and 400 <= status < 500:
+        return None
+    return STEP_RETRY
+
+
+DEFAULT_ESCALATION_RULES = [escalate_truncated_output, escalate_failed_call]
+
+
+def default_routes() -> dict:
+    """Rutas por defecto, configurables por entorno."""
+    fast_model = os.getenv("GEMINI_FAST_MODEL", "gemini-2.0-flash-001")
+    strong_model = os.getenv("GEMINI_STRONG_MODEL", "gemini-2.5-flash")
+    return {
+        STEP_TOOL: Route(STEP_TOOL, fast_model, int(os.getenv("GEMINI_TOOL_MAX_TOKENS", "512")), 0.0),
+        STEP_FINAL: Route(STEP_FINAL, fast_model, int(os.getenv("GEMINI_FINAL_MAX_TOKENS", "1024")), 0.3),
+        STEP_RETRY: Route(STEP_RETRY, strong_model, int(os.getenv("GEMINI_RETRY_MAX_TOKENS", "1024")), 0.0),
+    }
+
+
+class ModelRouter:
+    """
+    Elige modelo y parámetros de generación según el tipo de paso, aplica las reglas
+    de escalado sobre el resultado y lleva estadísticas de latencia y éxito por ruta.
+    """
+
+    def __init__(self, routes: dict = None, rules: List[EscalationRule] = None, max_escalations: int = 2):
+        self.routes = routes or default_routes()
+        self.rules = DEFAULT_ESCALATION_RULES if rules is None else rules
+        self.max_escalations = max_escalations
+        self._lock = threading.Lock()
+        self._stats = {name: {"calls": 0, "ok": 0, "failed": 0, "escalated": 0, "total_seconds": 0.0} for name in self.routes}
+
+    def route_for(self, step: str) -> Route:
+        return self.routes.get(step, self.routes[STEP_TOOL])
+
+    def call(self, send: Callable[[Route], Outcome], step: str = None) -> str:
+        """
+        Ejecuta `send(route)` con la ruta del paso y, mientras alguna regla lo pida,
+        vuelve a ejecutarlo con la ruta escalada. Devuelve el texto del último intento
+        o relanza su error.
+        """
+        route = self.route_for(step or current_step())
+        for attempt in range(self.max_escalations + 1):
+            started = time.perf_counter()
+            try:
+                outcome = send(route)
+            except Exception as e:
+                outcome = Outcome(error=e)
+            self._record(route, time.perf_counter() - started, outcome)
+
+            target = None
+            if attempt < self.max_escalations:
+                target = next((name for name in (rule(route, outcome) for rule in self.rules) if name), None)
+            if target is None or target not in self.routes:
+                if outcome.error is not None:
+                    raise outcome.error
+                return outcome.text
+
+            with self._lock:
+                self._stats[route.name]["escalated"] += 1
+            metrics.increment(f"llm.route.{route.name}.escalated")
+            logging_manager.log_debug("Model Router", f"Escalating from '{route.name}' ({route.model}) to '{target}'")
+            route = self.routes[target]
+
+    def _record(self, route: Route, seconds: float, outcome: Outcome):
+        ok = outcome.error is None
+        with self._lock:
+            stats = self._stats[route.name]
+            stats["calls"] += 1
+            stats["ok" if ok else "failed"] += 1
+            stats["total_seconds"] += seconds
+        metrics.observe(f"llm.route.{route.name}", seconds)
+        metrics.increment(f"llm.route.{route.name}.{'ok' if ok else 'failed'}")
+
+    def stats(self) -> dict:
+        """Latencia media, tasa de éxito y escalados por ruta."""
+        with self._lock:
+            return {
+                name: {
+                    "model": self.routes[name].model,
+                    "calls": s["calls"],
+                    "success_rate": round(s["ok"] / s["calls"], 4) if s["calls"] else None,
+                    "avg_seconds": round(s["total_seconds"] / s["calls"], 4) if s["calls"] else None,
+                    "escalated": s["escalated"],
+                }
+                for name, s in self._stats.items()
+            }
+
+
+# Router compartido por todas las instancias de GeminiLLM
+gemini_router = ModelRouter()
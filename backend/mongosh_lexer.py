@@ -0,0 +1,58 @@
+# mongosh_lexer.py
+import re
+from typing import List, NamedTuple
+
+
+class Token(NamedTuple):
+    kind: str # "ident", "string", "number", "regex" o "punct"
+    value: str # Texto del token tal como aparece (las cadenas incluyen las comillas)
+    start: int
+    end: int
+
+
+# Una sola expresión compilada; el orden de las alternativas importa
+# (comentarios antes que '/', cadenas antes que la puntuación).
+_TOKEN_RE = re.compile(
+    r"""
+      (?P<ws>\s+)
+    | (?P<comment>//[^\n]*|/\*.*?\*/)
+    | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|`(?:[^`\\]|\\.)*`)
+    | (?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+    | (?P<ident>[A-Za-z_$][\w$]*)
+    | (?P<punct>=>|\.\.\.|[^\s\w])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+_REGEX_LITERAL_RE = re.compile(r"/(?:[^/\\\n]|\\.)+/[a-z]*")
+
+# Tras estos tokens, una '/' empieza una expresión regular y no una división
+_REGEX_PRECEDERS = {"(", ",", ":", "[", "{", "=", "!", "&", "|", "?", ";", "=>"}
+
+
+def tokenize(command: str) -> List[Token]:
+    """
+    Divide un comando de mongosh (JavaScript) en tokens, descartando espacios y comentarios.
+    Es tolerante: un carácter que no encaja en nada se devuelve como puntuación.
+    """
+    tokens = []
+    pos = 0
+    length = len(command)
+    while pos < length:
+        if command[pos] == "/" and (not tokens or tokens[-1].value in _REGEX_PRECEDERS):
+            match = _REGEX_LITERAL_RE.match(command, pos)
+            if match:
+                tokens.append(Token("regex", match.group(), pos, match.end()))
+                pos = match.end()
+                continue
+
+        match = _TOKEN_RE.match(command, pos)
+        kind = match.lastgroup
+        if kind not in ("ws", "comment"):
+            tokens.append(Token(kind, match.group(), pos, match.end()))
+        pos = match.end()
+    return tokens
+
+
+def string_value(token: Token) -> str:
+    """Contenido de un token de cadena, sin comillas."""
+    return token.value[1:-1] if token.kind == "string" else token.value
@@ -0,0 +1,163 @@
+# profiling.py
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+# Perfilado bajo demanda de peticiones concretas (cabecera X-Profile o ?profile=1 en /chat,
+# --profile en main.py). Desactivado no cuesta nada: no hay hooks ni hilos, solo la comprobación.
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MODES = ("sampling", "cprofile")
+DEFAULT_PROFILE_MODE = os.getenv("PROFILE_MODE", "sampling")
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+# cProfile usa un hook global del proceso (sys.monitoring desde Python 3.12): solo puede
+# haber uno activo, así que las peticiones "cprofile" simultáneas se rechazan con ProfilerBusy.
+_cprofile_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Ya hay otro perfil cProfile en curso en este proceso."""
+
+
+class StartupProfile:
+    """
+    Registra cuánto tarda cada fase del arranque (imports, lanzamiento de mongosh,
+    calentamiento del cliente HTTP...) para poder ver qué domina el cold start.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases = []  # Lista de (nombre, segundos, estado)
+
+    def record(self, name: str, seconds: float, status: str = "ok"):
+        """Añade una fase ya medida externamente."""
+        self.phases.append((name, seconds, status))
+
+    @contextmanager
+    def phase(self, name: str):
+        """Mide el bloque como una fase. Si lanza excepción, la fase queda marcada como 'error'."""
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, status)
+
+    def report(self) -> dict:
+        """Devuelve el perfil de arranque como diccionario serializable."""
+        return {
+            "elapsed_seconds": round(time.perf_counter() - self.started_at, 4),
+            "phases": [
+                {"name": name, "seconds": round(seconds, 4), "status": status}
+                for name, seconds, status in self.phases
+            ],
+        }
+
+    def format_report(self) -> str:
+        """Devuelve el perfil de arranque como texto legible (para el log o la consola)."""
+        lines = [f"{name:<24} {seconds * 1000:>9.1f} ms  {status}" for name, seconds, status in self.phases]
+        lines.append(f"{'total':<24} {(time.perf_counter() - self.started_at) * 1000:>9.1f} ms")
+        return "\n".join(lines)
+
+
+# Perfil global del proceso actual
+startup_profile = StartupProfile()
+
+
+class SamplingProfiler:
+    """
+    Perfilador por muestreo de un hilo: otro hilo lee su pila cada `interval` segundos
+    (sys._current_frames) y cuenta las pilas. Mide tiempo de reloj, así que también
+    muestra las esperas (HTTP a Gemini, salida de mongosh, colas). El resultado se
+    exporta en formato de pilas colapsadas ('a;b;c N'), el que leen flamegraph.pl,
+    speedscope o inferno.
+    """
+
+    def __init__(self, thread_id: int = None, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample_loop, daemon=True, name="sampling-profiler")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """Pilas colapsadas, una por línea: 'raíz;...;hoja muestras'."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _profile_path(label: str, extension: str, directory: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    safe_label = re.sub(r"[^\w.-]+", "_", label)
+    return os.path.join(directory, f"{safe_label}-{datetime.now():%Y%m%d-%H%M%S-%f}.{extension}")
+
+
+def run_profiled(func, label: str, mode: str = None, directory: str = None):
+    """
+    Ejecuta func() en el hilo actual bajo el perfilador indicado y guarda el resultado:
+      - "sampling": pilas colapsadas (<label>-<fecha>.folded) para generar un flamegraph;
+      - "cprofile": estadísticas deterministas de cProfile (<label>-<fecha>.prof, para pstats/snakeviz).
+    Devuelve (resultado de func, ruta del fichero). El fichero se guarda aunque func lance excepción.
+    Lanza ProfilerBusy si se pide "cprofile" mientras otro perfil cProfile está en curso.
+    """
+    mode = mode or DEFAULT_PROFILE_MODE
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode '{mode}' (expected one of {', '.join(PROFILE_MODES)})")
+    directory = directory or PROFILE_DIR
+
+    if mode == "cprofile":
+        if not _cprofile_lock.acquire(blocking=False):
+            raise ProfilerBusy("Another cprofile run is in progress; retry later or use the sampling mode")
+        try:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e: # Otra herramienta (un depurador, otro perfilador) tiene el hook
+                raise ProfilerBusy(str(e))
+            try:
+                result = func()
+            finally:
+                profiler.disable()
+                path = _profile_path(label, "prof", directory)
+                profiler.dump_stats(path)
+        finally:
+            _cprofile_lock.release()
+        return result, path
+
+    sampler = SamplingProfiler()
+    sampler.start()
+    try:
+        result = func()
+    finally:
+        sampler.stop()
+        path = _profile_path(label, "folded", directory)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(sampler.collapsed())
+    return result, path
@@ -0,0 +1,197 @@
+# result_compaction.py
+import os
+import threading
+
+import logging_manager
+import metrics
+from llm_scheduler import estimate_tokens
+from mongosh_lexer import string_value, tokenize
+
+# Compactación de resultados de mongosh antes de devolverlos al modelo: una lista de
+# documentos homogéneos se reescribe como cabecera + filas, sin repetir los nombres de
+# campo en cada documento ni la indentación. Se desactiva con RESULT_COMPACTION=0
+# (o poniendo ENABLED = False en tiempo de ejecución) para comparar.
+ENABLED = os.getenv("RESULT_COMPACTION", "1") != "0"
+
+MIN_DOCUMENTS = 2 # Con un solo documento no hay claves repetidas que ahorrar
+MAX_MISSING_RATIO = 0.3 # Fracción máxima de celdas vacías para considerar el conjunto homogéneo
+SEPARATOR = " | "
+
+_MORE_RESULTS = 'Type "it" for more'
+_OPEN = {"(", "[", "{"}
+_CLOSE = {")", "]", "}"}
+
+_lock = threading.Lock()
+_totals = {"calls": 0, "compacted": 0, "tokens_before": 0, "tokens_after": 0}
+
+
+class _NotDocuments(Exception):
+    """La salida no es una lista de documentos que sepamos leer."""
+
+
+class _Raw(str):
+    """Valor escalar tal como lo imprimió mongosh (ObjectId('...'), 'texto', 12.5, ISODate(...))."""
+
+
+class _Parser:
+    """Lector tolerante de la salida de mongosh (sintaxis de objetos JavaScript, no JSON estricto)."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def _peek(self):
+        return self.tokens[self.pos].value if self.pos < len(self.tokens) else None
+
+    def _expect(self, value: str):
+        if self._peek() != value:
+            raise _NotDocuments(f"expected '{value}'")
+        self.pos += 1
+
+    def parse(self):
+        value = self._value()
+        if self.pos != len(self.tokens):
+            raise _NotDocuments("trailing output")
+        return value
+
+    def _value(self):
+        token = self._peek()
+        if token == "{":
+            return self._object()
+        if token == "[":
+            return self._array()
+        return self._leaf()
+
+    def _object(self) -> dict:
+        self._expect("{")
+        document = {}
+        while self._peek() != "}":
+            if self.pos >= len(self.tokens) or self.tokens[self.pos].kind not in ("ident", "string", "number"):
+                raise _NotDocuments("expected a field name")
+            key = string_value(self.tokens[self.pos])
+            self.pos += 1
+            self._expect(":")
+            document[key] = self._value()
+            self._separator("}")
+        self.pos += 1
+        return document
+
+    def _array(self) -> list:
+        self._expect("[")
+        items = []
+        while self._peek() != "]":
+            items.append(self._value())
+            self._separator("]")
+        self.pos += 1
+        return items
+
+    def _separator(self, closing: str):
+        if self._peek() == ",":
+            self.pos += 1
+        elif self._peek() != closing:
+            raise _NotDocuments(f"expected ',' or '{closing}'")
+
+    def _leaf(self) -> _Raw:
+        """Todo hasta la siguiente ',' o cierre al mismo nivel (admite llamadas como ObjectId('...'))."""
+        start, depth = self.pos, 0
+        while self.pos < len(self.tokens):
+            value = self.tokens[self.pos].value
+            if value in _OPEN:
+                depth += 1
+            elif value in _CLOSE:
+                if depth == 0:
+                    break
+                depth -= 1
+            elif value == "," and depth == 0:
+                break
+            self.pos += 1
+        if self.pos == start:
+            raise _NotDocuments("expected a value")
+        return _Raw(self.text[self.tokens[start].start:self.tokens[self.pos - 1].end])
+
+
+def _inline(value) -> str:
+    """Valor anidado (array u objeto) en una sola línea, sin espacios de sobra."""
+    if isinstance(value, dict):
+        return "{" + ",".join(f"{key}:{_inline(item)}" for key, item in value.items()) + "}"
+    if isinstance(value, list):
+        return "[" + ",".join(_inline(item) for item in value) + "]"
+    return value
+
+
+def _flatten(document: dict, prefix: str = "", row: dict = None) -> dict:
+    """Aplana los subdocumentos en campos con punto ('dims.w'); los arrays se quedan en línea."""
+    row = {} if row is None else row
+    for key, value in document.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and value:
+            _flatten(value, f"{name}.", row)
+        else:
+            row[name] = _inline(value)
+    return row
+
+
+def _tabulate(documents: list):
+    """Cabecera + filas para una lista de documentos homogéneos, o None si no lo son."""
+    if len(documents) < MIN_DOCUMENTS or not all(isinstance(document, dict) for document in documents):
+        return None
+    rows = [_flatten(document) for document in documents]
+    columns = list(dict.fromkeys(name for row in rows for name in row))
+    missing = sum(len(columns) - len(row) for row in rows)
+    if missing > MAX_MISSING_RATIO * len(columns) * len(rows):
+        return None
+    lines = [f"{len(rows)} documentos (tabla, un documento por fila): {SEPARATOR.join(columns)}"]
+    lines.extend(SEPARATOR.join(row.get(column, "") for column in columns) for row in rows)
+    return "\n".join(lines)
+
+
+def compact_result(output: str) -> str:
+    """
+    Devuelve la salida de mongosh lista para el prompt: compactada si es una lista de
+    documentos homogéneos (y el resultado es más corto), o sin cambios en otro caso.
+    """
+    if not ENABLED:
+        return output
+    body, more = output.rstrip(), ""
+    if body.endswith(_MORE_RESULTS):
+        body, more = body[:-len(_MORE_RESULTS)].rstrip(), f"\n{_MORE_RESULTS}"
+
+    compacted = None
+    if body.startswith("["):
+        try:
+            documents = _Parser(body).parse()
+        except _NotDocuments:
+            documents = None
+        if isinstance(documents, list):
+            table = _tabulate(documents)
+            if table is not None:
+                compacted = table + more
+
+    tokens_before = estimate_tokens(output)
+    tokens_after = estimate_tokens(compacted) if compacted is not None else tokens_before
+    if tokens_after >= tokens_before:
+        compacted, tokens_after = None, tokens_before
+    with _lock:
+        _totals["calls"] += 1
+        _totals["tokens_before"] += tokens_before
+        _totals["tokens_after"] += tokens_after
+        _totals["compacted"] += compacted is not None
+    metrics.increment("result_compaction.tokens_saved", tokens_before - tokens_after)
+    if compacted is None:
+        return output
+    metrics.increment("result_compaction.compacted")
+    logging_manager.log_debug("Result Compaction", f"~{tokens_before} -> ~{tokens_after} tokens")
+    return compacted
+
+
+def compaction_stats() -> dict:
+    """Resultados compactados y tokens (estimados) antes y después, acumulados desde el arranque."""
+    with _lock:
+        totals = dict(_totals)
+    before = totals["tokens_before"]
+    return {
+        "enabled": ENABLED,
+        **totals,
+        "saved_ratio": round(1 - totals["tokens_after"] / before, 4) if before else None,
+    }
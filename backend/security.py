@@ -1,10 +1,187 @@
 # security.py
+from dataclasses import dataclass, field
+from typing import List
+
+from mongosh_lexer import string_value, tokenize
+
+# Categorías de comando, de menor a mayor riesgo
+READ = "read"
+WRITE = "write"
+DESTRUCTIVE = "destructive"
+_SEVERITY = {READ: 0, WRITE: 1, DESTRUCTIVE: 2}
+
+# Métodos de mongosh (colección, base de datos, rs/sh) según lo que hacen al invocarse
+DESTRUCTIVE_METHODS = {
+    "drop", "dropDatabase", "dropIndex", "dropIndexes", "dropSearchIndex",
+    "deleteOne", "deleteMany", "remove", "findOneAndDelete",
+    "dropUser", "dropAllUsers", "dropRole", "dropAllRoles",
+    "shutdownServer", "killOp", "removeShard", "stepDown",
+}
+WRITE_METHODS = {
+    "insert", "insertOne", "insertMany", "save",
+    "update", "updateOne", "updateMany", "replaceOne",
+    "findOneAndUpdate", "findOneAndReplace", "findAndModify", "bulkWrite",
+    "createCollection", "createView", "createIndex", "createIndexes", "ensureIndex",
+    "hideIndex", "unhideIndex", "renameCollection",
+    "createUser", "updateUser", "changeUserPassword", "grantRolesToUser", "revokeRolesFromUser",
+    "createRole", "updateRole", "grantPrivilegesToRole", "revokePrivilegesFromRole",
+    "setProfilingLevel", "fsyncLock", "fsyncUnlock",
+}
+# Código que no se puede inspeccionar estáticamente: se trata como destructivo
+DYNAMIC_CODE = {"eval", "Function", "load"}
+
+# Verbos de db.runCommand({ <verbo>: ... }) / db.adminCommand(...)
+DESTRUCTIVE_COMMAND_VERBS = {
+    "drop", "dropDatabase", "delete", "dropIndexes", "deleteIndexes",
+    "dropUser", "dropAllUsersFromDatabase", "dropRole", "dropAllRolesFromDatabase",
+    "killOp", "killCursors", "killSessions", "killAllSessions", "killAllSessionsByPattern",
+    "shutdown", "removeShard", "replSetStepDown", "compact",
+}
+WRITE_COMMAND_VERBS = {
+    "insert", "update", "findAndModify", "create", "createIndexes", "collMod",
+    "renameCollection", "cloneCollectionAsCapped", "convertToCapped",
+    "createUser", "updateUser", "grantRolesToUser", "revokeRolesFromUser",
+    "createRole", "updateRole", "setParameter", "fsync", "profile",
+}
+COMMAND_RUNNERS = {"runCommand", "adminCommand"}
+
+# Etapas de aggregate que escriben: $out reemplaza la colección destino completa
+DESTRUCTIVE_STAGES = {"$out"}
+WRITE_STAGES = {"$merge"}
+
+# Operaciones de bulkWrite que borran documentos
+BULK_DESTRUCTIVE_OPS = {"deleteOne", "deleteMany"}
+
+
+@dataclass
+class CommandInfo:
+    """Resultado del análisis de un comando de mongosh."""
+    category: str = READ
+    methods: List[str] = field(default_factory=list) # Métodos/funciones invocados, en orden
+    command_verbs: List[str] = field(default_factory=list) # Verbos de runCommand/adminCommand
+    stages: List[str] = field(default_factory=list) # Etapas de escritura de aggregate ($out/$merge)
+    references: List[str] = field(default_factory=list) # Métodos destructivos referenciados sin llamarlos (db.c.drop.call(...))
+    dynamic_commands: int = 0 # runCommand/adminCommand cuyo argumento no es un literal
+    dynamic_calls: int = 0 # Llamadas con clave calculada: db.logs[m](), db.logs['dr' + 'op']()
+    find_and_modify_remove: bool = False # findAndModify con remove: true
+
+
+def inspect_command(command: str) -> CommandInfo:
+    """
+    Tokeniza el comando e identifica qué métodos se invocan, los verbos de
+    runCommand/adminCommand y las etapas $out/$merge, y lo clasifica como
+    lectura, escritura o destructivo.
+
+    Solo cuenta lo que realmente se invoca: un campo `deleted` en un filtro,
+    una colección llamada `removals` o un texto entre comillas no son llamadas.
+    Lo que no se puede resolver estáticamente se trata como destructivo: un método
+    destructivo referenciado sin llamarlo directamente (db.c.drop.call(db.c)), una
+    llamada cuyo nombre es una clave calculada (db.c[m](), db.c['dr' + 'op']()) o un
+    runCommand/adminCommand cuyo argumento no es un literal.
+    """
+    tokens = tokenize(command)
+    info = CommandInfo()
+    object_keys = set()
+    brackets = [] # Posiciones de los '[' abiertos
+
+    for i, token in enumerate(tokens):
+        nxt = tokens[i + 1].value if i + 1 < len(tokens) else ""
+
+        if token.value == "[":
+            brackets.append(i)
+        elif token.value == "]" and brackets:
+            start = brackets.pop()
+            if _is_computed_call(tokens, start, i):
+                info.dynamic_calls += 1
+
+        if token.kind == "ident" and nxt == "(":
+            # Llamada: db.col.metodo(...) o funcion(...)
+            info.methods.append(token.value)
+        elif token.kind == "string" and nxt == "]" and i + 2 < len(tokens) and tokens[i + 2].value == "(":
+            # Llamada con notación de corchetes: db.col['drop']()
+            info.methods.append(string_value(token))
+        elif token.kind == "ident" and token.value in DESTRUCTIVE_METHODS and i > 0 and tokens[i - 1].value == ".":
+            # Referencia sin llamada directa: db.logs.drop.call(db.logs), const f = db.logs.drop
+            info.references.append(token.value)
+        elif (token.kind == "string" and string_value(token) in DESTRUCTIVE_METHODS and nxt == "]"
+              and i > 0 and tokens[i - 1].value == "["):
+            # Igual con corchetes: db.logs['drop'].call(db.logs)
+            info.references.append(string_value(token))
+        elif token.kind in ("ident", "string") and nxt == ":":
+            key = string_value(token)
+            object_keys.add(key)
+            if key in DESTRUCTIVE_STAGES or key in WRITE_STAGES:
+                info.stages.append(key)
+            if key == "remove" and i + 2 < len(tokens) and tokens[i + 2].value != "false":
+                info.find_and_modify_remove = True # Solo cuenta si hay un findAndModify (se comprueba abajo)
+
+        if token.value in COMMAND_RUNNERS and nxt == "(" and i + 2 < len(tokens):
+            # El verbo es la primera clave del documento, o la cadena si se usa la forma corta
+            arg = tokens[i + 2]
+            if (arg.value == "{" and i + 4 < len(tokens) and tokens[i + 3].kind in ("ident", "string")
+                    and tokens[i + 4].value == ":"):
+                info.command_verbs.append(string_value(tokens[i + 3]))
+            elif arg.kind == "string":
+                info.command_verbs.append(string_value(arg))
+            elif arg.value != ")":
+                # Variable, expresión o clave calculada: el verbo no se conoce
+                info.dynamic_commands += 1
+
+    severity = _SEVERITY[READ]
+    for method in info.methods:
+        if method in DESTRUCTIVE_METHODS or method in DYNAMIC_CODE:
+            severity = max(severity, _SEVERITY[DESTRUCTIVE])
+        elif method in WRITE_METHODS:
+            severity = max(severity, _SEVERITY[WRITE])
+    if "bulkWrite" in info.methods and object_keys & BULK_DESTRUCTIVE_OPS:
+        severity = max(severity, _SEVERITY[DESTRUCTIVE])
+    if info.find_and_modify_remove and "findAndModify" not in info.methods + info.command_verbs:
+        info.find_and_modify_remove = False
+    if info.references or info.dynamic_commands or info.dynamic_calls or info.find_and_modify_remove:
+        severity = max(severity, _SEVERITY[DESTRUCTIVE])
+    for verb in info.command_verbs:
+        if verb in DESTRUCTIVE_COMMAND_VERBS:
+            severity = max(severity, _SEVERITY[DESTRUCTIVE])
+        elif verb in WRITE_COMMAND_VERBS:
+            severity = max(severity, _SEVERITY[WRITE])
+    for stage in info.stages:
+        severity = max(severity, _SEVERITY[DESTRUCTIVE if stage in DESTRUCTIVE_STAGES else WRITE])
+
+    info.category = next(name for name, level in _SEVERITY.items() if level == severity)
+    return info
+
+
+def _is_computed_call(tokens, start: int, end: int) -> bool:
+    """
+    True si tokens[start:end + 1] es un acceso con corchetes (obj[...], no un array literal)
+    cuya clave no es una sola cadena o número y que se invoca: obj[k](), obj[k].call(...).
+    """
+    if start == 0 or not (tokens[start - 1].kind == "ident" or tokens[start - 1].value in (")", "]")):
+        return False
+    key = tokens[start + 1:end]
+    if len(key) == 1 and key[0].kind in ("string", "number") and "${" not in key[0].value:
+        return False
+    after = [token.value for token in tokens[end + 1:end + 3]]
+    return after[:1] == ["("] or (after[:1] == ["."] and after[1:] in (["call"], ["apply"], ["bind"]))
+
+
+def classify_command(command: str) -> str:
+    """Devuelve la categoría del comando: 'read', 'write' o 'destructive'."""
+    return inspect_command(command).category
+
 
 def is_command_dangerous(command: str) -> bool:
     """
-    Evalúa si el comando contiene palabras clave potencialmente peligrosas.
-    Se buscan términos como 'drop', 'delete', 'remove', 'shutdown' o 'kill'.
+    Evalúa si el comando es destructivo (borra datos, colecciones, índices o usuarios,
+    mata operaciones o apaga el servidor) y por tanto requiere confirmación del usuario.
+    """
+    return classify_command(command) == DESTRUCTIVE
+
+
+def request_authorization() -> bool:
+    """
+    Pide al usuario por consola que autorice la ejecución de un comando peligroso.
+    Devuelve True solo si la respuesta es afirmativa.
     """
-    dangerous_keywords = ["drop", "delete", "remove", "shutdown", "kill"]
-    lower_command = command.lower()
-    return any(keyword in lower_command for keyword in dangerous_keywords)
+    answer = input("¿Autoriza la ejecución de este comando? (s/n): ")
+    return answer.strip().lower() in ("s", "si", "sí", "y", "yes")
@@ -0,0 +1,151 @@
+# stub_gemini.py
+# Servidor local que imita la API generateContent de Gemini y aplica cuotas
+# por ventana (peticiones y tokens), devolviendo 429 como el servicio real.
+# Sirve para probar el planificador y el agente sin gastar cuota real.
+#
+# Uso: python stub_gemini.py --port 8089 --rpm 15 --tpm 1000000
+#      GEMINI_API_BASE=http://127.0.0.1:8089/v1beta/models python main.py
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def default_reply(prompt: str, generation_config: dict, model: str):
+    """
+    Respuesta fija: JSON si se pidió salida estructurada, texto etiquetado si no.
+    Una función `reply` propia puede devolver texto o (texto, finishReason), o
+    lanzar una excepción para que el stub responda 500.
+    """
+    if generation_config.get("responseMimeType") == "application/json":
+        return json.dumps({"action": "respuesta usuario", "message": "Respuesta del stub."})
+    return "respuesta usuario: Respuesta del stub."
+
+
+class StubGeminiServer:
+    """
+    Stub de Gemini con cuotas por ventana fija de `window` segundos.
+    `accepted` y `rejected` cuentan las peticiones servidas y las rechazadas con 429;
+    `calls_by_model` cuenta las peticiones recibidas por cada modelo.
+    `latency` (modelo -> segundos) simula modelos más lentos que otros.
+    """
+
+    def __init__(self, port: int = 0, rpm: int = 15, tpm: int = 1_000_000, window: float = 60.0, reply=default_reply, latency: dict = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self.reply = reply
+        self.latency = latency or {}
+        self.calls_by_model = {}
+        self.accepted = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_requests = 0
+        self._window_tokens = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/v1beta/models"
+
+    def endpoint(self, model: str = "gemini-2.0-flash-001") -> str:
+        return f"{self.base_url}/{model}:generateContent"
+
+    def _admit(self, tokens: int):
+        """Devuelve None si la petición cabe en la cuota, o los segundos hasta la siguiente ventana."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= self.window:
+                self._window_start, self._window_requests, self._window_tokens = now, 0, 0
+            if self._window_requests + 1 > self.rpm or self._window_tokens + tokens > self.tpm:
+                self.rejected += 1
+                return self.window - (now - self._window_start)
+            self._window_requests += 1
+            self._window_tokens += tokens
+            self.accepted += 1
+            return None
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass # Silencioso
+
+            def _send_json(self, status: int, body: dict, headers: dict = None):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                # Metadatos del modelo (lo usa GeminiLLM.warm_up)
+                model = self.path.split("?")[0].rsplit("/", 1)[-1]
+                self._send_json(200, {"name": f"models/{model}"})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                prompt = "".join(part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", []))
+                generation_config = body.get("generationConfig", {})
+                model = self.path.split("?")[0].rsplit("/", 1)[-1].split(":")[0]
+                with stub._lock:
+                    stub.calls_by_model[model] = stub.calls_by_model.get(model, 0) + 1
+                time.sleep(stub.latency.get(model, 0))
+
+                try:
+                    reply = stub.reply(prompt, generation_config, model)
+                except Exception as e:
+                    self._send_json(500, {"error": {"code": 500, "status": "INTERNAL", "message": str(e)}})
+                    return
+                text, finish_reason = reply if isinstance(reply, tuple) else (reply, "STOP")
+                tokens = len(prompt) // 4 + len(text) // 4
+
+                retry_after = stub._admit(tokens)
+                if retry_after is not None:
+                    delay = f"{max(retry_after, 0.01):.2f}"
+                    self._send_json(
+                        429,
+                        {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "details": [{"retryDelay": f"{delay}s"}]}},
+                        {"Retry-After": delay},
+                    )
+                    return
+
+                self._send_json(200, {
+                    "candidates": [{"content": {"parts": [{"text": text}]}, "finishReason": finish_reason}],
+                    "usageMetadata": {"totalTokenCount": tokens},
+                })
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub local de la API de Gemini con cuotas.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--rpm", type=int, default=15, help="Peticiones por ventana")
+    parser.add_argument("--tpm", type=int, default=1_000_000, help="Tokens por ventana")
+    parser.add_argument("--window", type=float, default=60.0, help="Duración de la ventana en segundos")
+    args = parser.parse_args()
+
+    server = StubGeminiServer(port=args.port, rpm=args.rpm, tpm=args.tpm, window=args.window)
+    print(f"Stub de Gemini escuchando en {server.endpoint()}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,81 @@
+# test_admission.py
+# Pruebas del control de admisión de /chat: orden por sesión, cola llena y espera máxima.
+import asyncio
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def test_same_session_requests_run_one_at_a_time_in_arrival_order():
+    async def scenario():
+        controller = AdmissionController(max_active=4, max_queue=10, max_wait=5)
+        events = []
+
+        async def request(name):
+            async with controller.admit("sesion"):
+                events.append(f"{name} start")
+                await asyncio.sleep(0.01)
+                events.append(f"{name} end")
+
+        tasks = []
+        for name in ("a", "b", "c"):
+            tasks.append(asyncio.create_task(request(name)))
+            await asyncio.sleep(0) # Llegan en este orden
+        await asyncio.gather(*tasks)
+        return events
+
+    assert asyncio.run(scenario()) == ["a start", "a end", "b start", "b end", "c start", "c end"]
+
+
+def test_request_is_rejected_when_the_queue_is_full():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queue=1, max_wait=5)
+        release = asyncio.Event()
+
+        async def holder(session_id):
+            async with controller.admit(session_id):
+                await release.wait()
+
+        running = asyncio.create_task(holder("s1"))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(holder("s2"))
+        await asyncio.sleep(0)
+        try:
+            async with controller.admit("s3"):
+                assert False, "expected AdmissionRejected"
+        except AdmissionRejected as e:
+            rejection = e
+        release.set()
+        await asyncio.gather(running, queued)
+        return rejection
+
+    rejection = asyncio.run(scenario())
+    assert rejection.retry_after >= 1
+
+
+def test_waiting_longer_than_max_wait_is_rejected():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queue=5, max_wait=0.05)
+        release = asyncio.Event()
+
+        async def holder():
+            async with controller.admit("s1"):
+                await release.wait()
+
+        running = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        try:
+            async with controller.admit("s2"):
+                assert False, "expected AdmissionRejected"
+        except AdmissionRejected as e:
+            rejection = e
+        queue_after = controller._waiting
+        release.set()
+        await running
+        # Después del rechazo el controlador sigue admitiendo con normalidad
+        async with controller.admit("s2"):
+            pass
+        return rejection, queue_after
+
+    rejection, queue_after = asyncio.run(scenario())
+    assert "Timed out" in str(rejection)
+    assert queue_after == 0
@@ -0,0 +1,131 @@
+# test_agent.py
+# Pruebas del bucle del agente (AgentEngine) con un LLM guionizado y un ejecutor en
+# memoria: confirmaciones, reintentos, rutas del router y construcción del prompt.
+import agent
+import llm_scheduler
+import model_router
+from agent import AgentEngine, TurnBuffer
+
+
+class ScriptedLLM:
+    """LLM de prueba: devuelve las respuestas en orden y anota prompt, tipo de paso y prioridad."""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = []
+
+    def __call__(self, prompt: str) -> str:
+        self.calls.append((prompt, model_router.current_step(), llm_scheduler._current_priority.get()))
+        return self.replies.pop(0)
+
+    @property
+    def steps(self):
+        return [step for _, step, _ in self.calls]
+
+
+def _engine(llm, outputs=None, **kwargs):
+    executed = []
+
+    def execute(command):
+        executed.append(command)
+        return (outputs or {}).get(command, "ok")
+
+    engine = AgentEngine(llm=llm, execute=execute, compact=lambda output: output, **kwargs)
+    return engine, executed
+
+
+def test_runs_commands_until_the_user_response():
+    llm = ScriptedLLM("consulta mongo: db.pedidos.countDocuments({})", "respuesta usuario: Hay 5 pedidos.")
+    engine, executed = _engine(llm, {"db.pedidos.countDocuments({})": "5"})
+    seen = []
+    result = engine.run("¿Cuántos pedidos hay?", on_mongo_response=seen.append)
+    assert (result.status, result.response, result.iterations) == ("completed", "Hay 5 pedidos.", 2)
+    assert executed == ["db.pedidos.countDocuments({})"]
+    assert seen == ["respuesta mongo: 5"]
+    assert llm.steps == [model_router.STEP_TOOL, model_router.STEP_TOOL]
+    assert "Entrada del usuario: respuesta mongo: 5\n" in llm.calls[1][0]
+
+
+def test_dangerous_command_requires_confirmation():
+    llm = ScriptedLLM("consulta mongo: db.logs.drop()")
+    engine, executed = _engine(llm)
+    result = engine.run("Borra los logs")
+    assert result.status == "confirmation_required"
+    assert result.command_to_confirm == "db.logs.drop()"
+    assert executed == []
+
+
+def test_denied_authorization_cancels_and_is_recorded():
+    llm = ScriptedLLM("consulta mongo: db.logs.drop()")
+    engine, executed = _engine(llm)
+    asked = []
+    result = engine.run("Borra los logs", authorize=lambda command: asked.append(command) or False)
+    assert result.status == "cancelled"
+    assert asked == ["db.logs.drop()"]
+    assert executed == []
+    assert engine.turns.history.endswith("respuesta modelo: respuesta usuario: " + result.response)
+
+
+def test_granted_authorization_executes_the_command():
+    llm = ScriptedLLM("consulta mongo: db.logs.drop()", "respuesta usuario: Colección eliminada.")
+    engine, executed = _engine(llm)
+    result = engine.run("Borra los logs", authorize=lambda command: True)
+    assert result.status == "completed"
+    assert executed == ["db.logs.drop()"]
+
+
+def test_run_confirmed_executes_and_continues_as_a_continuation():
+    llm = ScriptedLLM("respuesta usuario: Colección eliminada.")
+    engine, executed = _engine(llm, {"db.logs.drop()": "true"})
+    result = engine.run_confirmed("db.logs.drop()")
+    assert result.status == "completed"
+    assert executed == ["db.logs.drop()"]
+    prompt, _, priority = llm.calls[0]
+    assert "Entrada del usuario: respuesta mongo: true\n" in prompt
+    assert priority == llm_scheduler.PRIORITY_CONTINUATION
+
+
+def test_unparseable_reply_is_retried_on_the_retry_route():
+    llm = ScriptedLLM("no sé", "respuesta usuario: Hola.")
+    engine, _ = _engine(llm)
+    result = engine.run("Hola")
+    assert (result.status, result.response, result.iterations) == ("completed", "Hola.", 1)
+    assert llm.steps == [model_router.STEP_TOOL, model_router.STEP_RETRY]
+    assert llm.calls[0][0] == llm.calls[1][0] # Mismo prompt, otra ruta
+
+
+def test_reply_still_unparseable_after_the_retry_is_an_error():
+    llm = ScriptedLLM("no sé", "tampoco")
+    engine, _ = _engine(llm)
+    result = engine.run("Hola")
+    assert result.status == "error"
+    assert "Unexpected model response format: tampoco" in result.response
+
+
+def test_mongo_error_sends_the_next_step_to_the_retry_route():
+    llm = ScriptedLLM("consulta mongo: db.pedidos.fnd()", "consulta mongo: db.pedidos.find()", "respuesta usuario: Listo.")
+    engine, _ = _engine(llm, {"db.pedidos.fnd()": "TypeError: db.pedidos.fnd is not a function"})
+    assert engine.run("Busca los pedidos").status == "completed"
+    assert llm.steps == [model_router.STEP_TOOL, model_router.STEP_RETRY, model_router.STEP_TOOL]
+
+
+def test_stops_after_max_iterations():
+    llm = ScriptedLLM(*["consulta mongo: db.pedidos.find()"] * 3)
+    engine, executed = _engine(llm, max_iterations=3)
+    result = engine.run("Busca los pedidos")
+    assert result.status == "error"
+    assert result.iterations == 3
+    assert len(executed) == 3
+
+
+def test_render_matches_the_prompt_template_output():
+    # Lo que producían PromptTemplate(template=TEMPLATE).format(...) y ConversationBufferMemory
+    # con human_prefix="consulta usuario" y ai_prefix="respuesta modelo"
+    turns = TurnBuffer()
+    assert turns.render("hola") == agent.TEMPLATE.format(history="", input="hola")
+    turns.append("¿Cuántos pedidos hay?", "consulta mongo: db.pedidos.countDocuments({})")
+    turns.append("respuesta mongo: 5", "respuesta usuario: Hay 5.")
+    history = ("consulta usuario: ¿Cuántos pedidos hay?\nrespuesta modelo: consulta mongo: db.pedidos.countDocuments({})\n"
+               "consulta usuario: respuesta mongo: 5\nrespuesta modelo: respuesta usuario: Hay 5.")
+    assert turns.history == history
+    assert turns.render("gracias") == agent.TEMPLATE.format(history=history, input="gracias")
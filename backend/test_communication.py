@@ -0,0 +1,86 @@
+# test_communication.py
+# Pruebas del parseo de la salida del modelo (JSON estructurado, JSON reparado y protocolo
+# de texto) y de sus contadores; son funciones puras, no necesitan el cliente de Gemini.
+import agent
+import communication
+import metrics
+from communication import LABEL_CONSULTA_MONGO, LABEL_RESPUESTA_USUARIO, parse_model_output
+
+
+def _counters():
+    return {name: metrics.get_counter(f"llm.output.{name}") for name in ("json_ok", "repaired", "text_ok", "format_failed")}
+
+
+def _delta(before: dict) -> dict:
+    return {name: value - before[name] for name, value in _counters().items() if value != before[name]}
+
+
+def test_valid_json():
+    before = _counters()
+    assert parse_model_output('{"action": "consulta mongo", "command": "db.pedidos.find()"}') == \
+        (LABEL_CONSULTA_MONGO, "db.pedidos.find()")
+    assert parse_model_output('{"action": "respuesta usuario", "message": " Hay 5 pedidos. "}') == \
+        (LABEL_RESPUESTA_USUARIO, "Hay 5 pedidos.")
+    assert parse_model_output('{"action": "consulta mongo", "command": "db.logs.find()", "database": "auditoria"}') == \
+        (LABEL_CONSULTA_MONGO, "use auditoria; db.logs.find()")
+    assert _delta(before) == {"json_ok": 3}
+
+
+def test_fenced_and_wrapped_json_are_repaired():
+    before = _counters()
+    fenced = '```json\n{"action": "consulta mongo", "command": "show dbs"}\n```'
+    wrapped = 'Claro, aquí está: {"action": "respuesta usuario", "message": "Listo."} ¿Algo más?'
+    assert parse_model_output(fenced) == (LABEL_CONSULTA_MONGO, "show dbs")
+    assert parse_model_output(wrapped) == (LABEL_RESPUESTA_USUARIO, "Listo.")
+    assert _delta(before) == {"repaired": 2}
+
+
+def test_schema_violations_are_rejected():
+    for data in (
+        {"action": "consulta mongo"}, # Falta el comando
+        {"action": "consulta mongo", "command": "   "},
+        {"action": "consulta mongo", "message": "db.x.find()"}, # Campo equivocado para la acción
+        {"action": "ejecutar", "command": "db.x.find()"}, # Acción fuera del enum
+        {"command": "db.x.find()"},
+        ["consulta mongo", "db.x.find()"],
+    ):
+        assert communication._validate_structured(data) is None, data
+    message = '{"action": "borrar", "command": "db.x.drop()"}'
+    assert communication.parse_structured_message(message) == (None, message)
+
+
+def test_text_protocol_fallback():
+    before = _counters()
+    assert parse_model_output("consulta mongo: db.pedidos.countDocuments({})") == \
+        (LABEL_CONSULTA_MONGO, "db.pedidos.countDocuments({})")
+    # Un JSON que no cumple el esquema no impide leer la etiqueta de texto
+    assert parse_model_output('respuesta usuario: el campo {"action": 1} no es válido') == \
+        (LABEL_RESPUESTA_USUARIO, 'el campo {"action": 1} no es válido')
+    assert _delta(before) == {"text_ok": 2}
+
+
+def test_unparseable_output_counts_as_failure():
+    before = _counters()
+    assert parse_model_output("No sé qué hacer.") == (None, "No sé qué hacer.")
+    assert parse_model_output('{"action": "consulta mongo"}') == (None, '{"action": "consulta mongo"}')
+    assert _delta(before) == {"format_failed": 2}
+
+
+def test_output_format_stats_rates():
+    metrics.reset()
+    parse_model_output('{"action": "consulta mongo", "command": "show dbs"}')
+    parse_model_output('```{"action": "consulta mongo", "command": "show dbs"}```')
+    parse_model_output("consulta mongo: show dbs")
+    parse_model_output("???")
+    stats = communication.output_format_stats()
+    assert stats == {"json_ok": 1, "repaired": 1, "text_ok": 1, "format_failed": 1, "total": 4,
+                     "repair_rate": 0.25, "failure_rate": 0.25}
+
+
+def test_json_mode_prompt_describes_the_schema_fields():
+    prompt = agent.TurnBuffer(response_mode="json").render("hola")
+    for field in ('"action"', '"command"', '"database"', '"message"'):
+        assert field in prompt
+    assert "DEBE empezar SIEMPRE con `consulta mongo:`" not in prompt
+    assert prompt.endswith("Tu respuesta (objeto JSON):")
+    assert agent.TurnBuffer().render("hola").endswith("Tu respuesta (con etiqueta):")
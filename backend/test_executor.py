@@ -1,54 +1,312 @@
 # test_executor.py
-# test_executor.py
-import sys  # Mantener sys solo para sys.exit
-
-# import os # No es necesario
-
-# Ya no se necesita manipular sys.path
-
-try:
-    # Usar importaciones directas ya que todos los .py están en la raíz
-    import executor
-    import logging_manager
-    print("Módulos importados correctamente.")
-except ImportError as e:
-    print(f"Error al importar módulos: {e}")
-    sys.exit(1)
-
-# Comandos a probar
-test_commands = [
-    "use test",             # Cambiar a la BD 'test'
-    "db.getName()",         # Confirmar BD actual
-    # Insertar datos para crear físicamente la BD y una colección (Sintaxis corregida)
-    "db.test_collection.insertMany([{ name: 'Alice', age: 30 }, { name: 'Bob', age: 25 }])",
-    "show collections",     # Comando simple (ahora debería mostrar 'test_collection')
-    "db.getCollectionNames()", # Método JS (ahora debería incluir 'test_collection')
-    "db.test_collection.countDocuments()", # Contar documentos insertados
-    "use historias",        # Cambiar a 'historias'
-    "db.getName()",         # Confirmar BD actual
-    "db.getCollectionNames()", # Colecciones en 'historias'
-    "use wallapop-clone",   # Cambiar a 'wallapop-clone'
-    "db.getName()",         # Confirmar BD actual
-    "db.getCollectionNames()", # Colecciones en 'wallapop-clone'
-    "print('hello world')", # Comando JS simple para ver salida
-    "use test; db.test_chain.insertOne({ message: 'chained command test' }); db.test_chain.find()", # Comando encadenado (Known issue: only first part executes)
-]
-
-print("\n--- Iniciando Test de Executor ---")
-
-for command in test_commands:
-    print(f"\n>>> Ejecutando Comando: {command}")
+# Pruebas del ejecutor: contexto de base de datos por sesión (sin proceso, registrando
+# los comandos que llegarían a mongosh) y recuperación ante caídas con un shell falso
+# que entiende los marcadores print('a' + 'b').
+import sys
+import threading
+import time
+
+import communication
+import executor
+import metrics
+from executor import MongoExecutor, SingleFlight, TimeoutPolicy, command_class, pin_to_database, split_use, with_max_time
+
+FAKE_SHELL = r"""
+import os, re, sys, time
+for line in sys.stdin:
+    marker = re.match(r"print\('(.*)' \+ '(.*)'\)", line)
+    if marker:
+        print(marker.group(1) + marker.group(2), flush=True)
+    elif line.startswith("crash"):
+        os._exit(1)
+    elif line.startswith("sleep"):
+        time.sleep(30)
+    elif "killOp" in line:
+        print("killed:" + str(line.count("agent-test")), flush=True)
+    else:
+        print("ran: " + line.strip(), flush=True)
+"""
+
+
+class RecordingExecutor(MongoExecutor):
+    """MongoExecutor sin proceso: guarda lo que se enviaría a mongosh."""
+
+    def _start_process(self):
+        self.sent = []
+
+    def _execute(self, command: str) -> str:
+        self.sent.append(command)
+        return "ok"
+
+
+def test_command_class():
+    assert command_class("use ventas") == "shell"
+    assert command_class("show dbs") == "shell"
+    assert command_class("db.pedidos.find({ total: { $gt: 5 } }).sort({ fecha: -1 })") == "find"
+    assert command_class("db.pedidos.aggregate([{ $group: { _id: '$cliente' } }])") == "aggregate"
+    assert command_class("db.pedidos.countDocuments({})") == "count"
+    assert command_class("db.pedidos.updateOne({ _id: 1 }, { $set: { find: 1 } })") == "write"
+    assert command_class("db.runCommand({ ping: 1 })") == "admin"
+    assert command_class("db.getCollectionNames()") == "other"
+
+
+def test_with_max_time():
+    assert with_max_time("db.pedidos.find({}).limit(5);", 900) == "db.pedidos.find({}).limit(5).maxTimeMS(900)"
+    assert with_max_time("db.pedidos.aggregate([])", 900) == "db.pedidos.aggregate([]).maxTimeMS(900)"
+    # Ya lo lleva, no termina en cursor, o no es find/aggregate: sin cambios
+    for command in ("db.p.find().maxTimeMS(10)", "db.p.find().toArray()", "db.p.countDocuments({})", "show dbs"):
+        assert with_max_time(command, 900) == command
+
+
+def test_timeout_policy_learns_but_never_drops_below_the_class_default():
+    policy = TimeoutPolicy()
+    assert policy.timeout_for("aggregate") == executor.DEFAULT_TIMEOUTS["aggregate"]
+    for _ in range(10):
+        policy.record("aggregate", 0.05) # Agregaciones rápidas: el timeout no baja del suelo
+    assert policy.timeout_for("aggregate") == executor.TIMEOUT_FLOORS["aggregate"]
+    for _ in range(10):
+        policy.record("find", 8.0) # Búsquedas lentas: crece por encima del valor inicial
+    assert policy.timeout_for("find") == 8.0 * 3 + 0.5
+
+
+def test_timeout_policy_backs_off_after_timeouts():
+    policy = TimeoutPolicy()
+    for _ in range(policy.window):
+        policy.record("count", 0.05)
+    first = policy.timeout_for("count")
+    policy.record_timeout("count", first)
+    assert policy.timeout_for("count") == 2 * first
+    policy.record_timeout("count", 2 * first)
+    policy.record_timeout("count", 4 * first)
+    assert policy.timeout_for("count") == executor.TIMEOUT_CAPS["count"]
+    policy.record("count", 0.05) # Un comando que termina quita el back-off
+    assert policy.timeout_for("count") < executor.TIMEOUT_CAPS["count"]
+
+
+def test_split_use():
+    assert split_use("use ventas") == ("ventas", "")
+    assert split_use("use ventas; db.pedidos.find()") == ("ventas", "db.pedidos.find()")
+    assert split_use("  use 'ventas' ;") == ("ventas", "")
+    assert split_use("users.find()") == (None, "users.find()")
+
+
+def test_pin_to_database_rewrites_only_the_db_identifier():
+    assert pin_to_database("db.pedidos.find({ db: 1, total: { $gt: 5 } })", "ventas") == \
+        'db.getSiblingDB("ventas").pedidos.find({ db: 1, total: { $gt: 5 } })'
+    assert pin_to_database("db.a.find().forEach(d => db.b.insertOne(d)); cfg.db", "x") == \
+        'db.getSiblingDB("x").a.find().forEach(d => db.getSiblingDB("x").b.insertOne(d)); cfg.db'
+    assert pin_to_database("print('db')", "x") == "print('db')"
+    assert pin_to_database("show collections", "x") == "print(db.getSiblingDB(\"x\").getCollectionNames().join('\\n'))"
+
+
+
+def test_database_scoped_show_helpers_are_pinned():
+    assert pin_to_database("show users", "rrhh") == 'db.getSiblingDB("rrhh").getUsers()'
+    assert pin_to_database("show roles;", "rrhh") == 'db.getSiblingDB("rrhh").getRoles({ showBuiltinRoles: true })'
+    assert pin_to_database("show profile", "rrhh").startswith('db.getSiblingDB("rrhh").system.profile.find(')
+    assert pin_to_database("show dbs", "rrhh") == "show dbs" # Del servidor, no de una base de datos
+
+
+def test_embedded_shell_helpers_are_rejected():
+    for command in ("use rrhh; db.x.find()", "db.x.find()\nuse rrhh", "show users; db.x.drop()", "db.x.find(); show roles"):
+        try:
+            pin_to_database(command, "ventas")
+            assert False, f"expected ValueError for {command!r}"
+        except ValueError:
+            pass
+    shell = RecordingExecutor()
+    assert shell.execute_command("use ventas; use rrhh; db.x.find()", session_id="a").startswith("Error: only one leading 'use")
+    assert shell.sent == []
+    assert executor.is_command_dangerous("use ventas; use rrhh; db.x.find()")
+
+
+def test_sessions_keep_their_own_database():
+    shell = RecordingExecutor()
+    assert shell.execute_command("use ventas", session_id="a") == "switched to db ventas"
+    assert shell.sent == [] # 'use' no llega al shell
+
+    shell.execute_command("db.pedidos.countDocuments()", session_id="a")
+    shell.execute_command("db.pedidos.countDocuments()", session_id="b")
+    shell.execute_command("use rrhh; db.empleados.find()", session_id="b")
+    shell.execute_command("db.pedidos.insertOne({})", session_id="a")
+    assert shell.sent == [
+        'db.getSiblingDB("ventas").pedidos.countDocuments()',
+        f'db.getSiblingDB("{executor.DEFAULT_DATABASE}").pedidos.countDocuments()',
+        'db.getSiblingDB("rrhh").empleados.find()',
+        'db.getSiblingDB("ventas").pedidos.insertOne({})',
+    ]
+    assert shell.current_database("a") == "ventas"
+    assert shell.current_database("b") == "rrhh"
+
+
+def test_explicit_database_and_invalid_names():
+    shell = RecordingExecutor()
+    shell.execute_command("db.logs.find()", session_id="a", database="auditoria")
+    assert shell.sent == ['db.getSiblingDB("auditoria").logs.find()']
+    assert shell.current_database("a") == "auditoria"
+    assert shell.execute_command("use mal.nombre", session_id="a").startswith("Error: invalid database name")
+
+
+def test_database_name_injection_is_rejected_and_flagged():
+    message = '{"action": "consulta mongo", "command": "db.logs.find()", "database": "x\')+db[\'dropDatabase\']()+String(\'a"}'
+    label, command = communication.parse_structured_message(message)
+    assert executor.is_command_dangerous(command)
+    shell = RecordingExecutor()
+    assert shell.execute_command(command, session_id="a").startswith("Error: invalid database name")
+    assert shell.sent == []
     try:
-        output = executor.execute_mongo_command(command)
-        print(f"<<< Salida Recibida:\n{output}")
-        print("-" * 20)
-    except Exception as e:
-        print(f"!!! Excepción durante la ejecución: {e}")
-        print("-" * 20)
-
-print("\n--- Test de Executor Finalizado ---")
-
-# Opcional: Mostrar el log generado durante el test
-# print("\n--- Contenido del Log ---")
-# print(logging_manager.get_log())
-# print("------------------------")
+        pin_to_database("db.logs.find()", "x')+db.dropDatabase()+('")
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+
+
+def test_danger_check_runs_on_the_pinned_command():
+    assert executor.is_command_dangerous("use auditoria; db.logs.drop()")
+    assert not executor.is_command_dangerous("use auditoria; db.logs.find()")
+
+
+def test_structured_output_database_field():
+    message = '{"action": "consulta mongo", "command": "db.logs.find()", "database": "auditoria"}'
+    assert communication.parse_structured_message(message) == ("consulta mongo", "use auditoria; db.logs.find()")
+
+
+def _wait_until(condition, message: str):
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline, message
+        time.sleep(0.01)
+
+
+def test_single_flight_runs_identical_calls_once():
+    flight = SingleFlight("test.singleflight")
+    release = threading.Event()
+    runs, results = [], []
+
+    def slow_read():
+        runs.append(1)
+        release.wait(5)
+        return "3 documentos"
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", slow_read))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    _wait_until(lambda: "key" in flight._calls and flight._calls["key"].waiters == 4, "callers were not coalesced")
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert runs == [1]
+    assert results == ["3 documentos"] * 5
+    assert flight._calls == {}
+
+
+def test_only_stateless_reads_are_coalescable():
+    assert executor.is_coalescable("db.pedidos.find({ total: { $gt: 5 } })")
+    assert executor.is_coalescable("show collections")
+    for command in ("db.pedidos.insertOne({ total: 5 })", "db.pedidos.updateMany({}, { $set: { a: 1 } })",
+                    "db.pedidos.drop()", "use ventas", "use ventas; db.pedidos.find()", "it"):
+        assert not executor.is_coalescable(command), command
+
+
+def test_coalescing_key_includes_the_database():
+    class BlockingExecutor(RecordingExecutor):
+        def _execute(self, command: str) -> str:
+            self.sent.append(command)
+            release.wait(5)
+            return command
+
+    release = threading.Event()
+    shell = BlockingExecutor()
+    shell.session_dbs.update({"a": "ventas", "b": "compras", "c": "ventas"})
+    results = {}
+
+    def run(session_id):
+        results[session_id] = shell.execute_command("db.pedidos.find()", session_id=session_id)
+
+    threads = {session_id: threading.Thread(target=run, args=(session_id,)) for session_id in ("a", "b", "c")}
+    threads["a"].start()
+    _wait_until(lambda: len(shell.sent) == 1, "first read did not start")
+    threads["b"].start() # Misma consulta en otra base de datos: se ejecuta aparte
+    _wait_until(lambda: len(shell.sent) == 2, "read on another database was coalesced")
+    threads["c"].start() # Misma consulta y misma base de datos que 'a': comparte su resultado
+    key = ("ventas", executor.normalize_command("db.pedidos.find()"))
+    _wait_until(lambda: key in shell.single_flight._calls and shell.single_flight._calls[key].waiters == 1, "same-database read was not coalesced")
+    release.set()
+    for thread in threads.values():
+        thread.join(5)
+    assert shell.sent == [pin_to_database("db.pedidos.find()", "ventas"), pin_to_database("db.pedidos.find()", "compras")]
+    assert results["c"] == results["a"] != results["b"]
+
+
+def test_with_app_name():
+    assert executor.with_app_name("mongodb://localhost:27017", "a1") == "mongodb://localhost:27017/?appName=a1"
+    assert executor.with_app_name("mongodb://h1,h2/ventas", "a1") == "mongodb://h1,h2/ventas?appName=a1"
+    assert executor.with_app_name("mongodb://h/?tls=true", "a1") == "mongodb://h/?tls=true&appName=a1"
+    assert executor.with_app_name("mongodb://h/?appname=x&tls=true", "a1") == "mongodb://h/?appName=a1&tls=true"
+
+
+class FixedTimeouts(TimeoutPolicy):
+    """Timeout corto y fijo para no esperar los valores por defecto de cada clase."""
+
+    def timeout_for(self, cls: str) -> float:
+        return 0.5
+
+
+def _wait_for_standby(shell: MongoExecutor):
+    deadline = time.time() + 10
+    while not (shell.standby and shell.standby.alive()):
+        assert time.time() < deadline, "standby shell did not start"
+        time.sleep(0.05)
+
+
+def test_failover_swaps_in_the_standby_shell():
+    shell = MongoExecutor(command=[sys.executable, "-c", FAKE_SHELL], ping_interval=0)
+    try:
+        _wait_for_standby(shell)
+        shell.execute_command("use ventas", session_id="a")
+        assert shell.execute_command("db.pedidos.find()", session_id="a").startswith('ran: db.getSiblingDB("ventas").pedidos.find()')
+
+        # Muerte entre comandos: el siguiente comando se ejecuta en el standby
+        standby_pid = shell.standby.pid
+        swaps = metrics.get_counter("mongo.failovers.standby")
+        shell.shell.kill()
+        assert shell.execute_command("db.pedidos.find()", session_id="a").startswith('ran: db.getSiblingDB("ventas").pedidos.find()')
+        assert shell.shell.pid == standby_pid
+        assert metrics.get_counter("mongo.failovers.standby") == swaps + 1
+
+        # Caída durante un comando: se informa del error y el shell se reemplaza
+        _wait_for_standby(shell)
+        assert "terminated while running" in shell.execute_command("crash()", session_id="a")
+        assert shell.execute_command("db.getName()", session_id="a") == 'ran: db.getSiblingDB("ventas").getName()'
+
+        # El ping detecta un shell muerto sin esperar al siguiente comando
+        _wait_for_standby(shell)
+        shell.shell.kill()
+        assert shell.ping() is False
+        assert shell.shell.alive()
+    finally:
+        shell._stop_process()
+
+
+def test_timeout_recycles_the_shell_and_reports_the_server_side_state():
+    shell = MongoExecutor(command=[sys.executable, "-c", FAKE_SHELL], ping_interval=0)
+    shell.timeouts = FixedTimeouts()
+    try:
+        _wait_for_standby(shell)
+        # Sin appName no se puede matar la operación en el servidor: se avisa de que puede seguir
+        timed_out_pid = shell.shell.pid
+        error = shell.execute_command("sleep(); db.pedidos.updateMany({}, { $inc: { n: 1 } })", session_id="a")
+        assert "timed out after 0.5s and may still be running on the server" in error
+        assert "check the data before retrying" in error
+        assert shell.shell.pid != timed_out_pid
+        assert shell.timeouts.backoffs["write"] == shell.timeouts.backoff
+        assert shell.execute_command("db.getName()", session_id="a") == 'ran: db.getSiblingDB("test").getName()'
+
+        # Con appName, el shell nuevo mata sus operaciones con killOp
+        _wait_for_standby(shell)
+        shell.shell.app_name = "agent-test"
+        error = shell.execute_command("sleep(); db.pedidos.countDocuments({})", session_id="a")
+        assert error == "Error: Command timed out after 0.5s and was stopped on the server."
+        assert shell.execute_command("db.getName()", session_id="a") == 'ran: db.getSiblingDB("test").getName()'
+    finally:
+        shell._stop_process()
@@ -0,0 +1,91 @@
+# test_ingest.py
+# Pruebas de la carga masiva (lectura por streaming, lotes y modo ordenado/no ordenado)
+# con un escritor en memoria en lugar de MongoDB.
+import asyncio
+
+import ingest
+
+
+async def _chunks(data: bytes, size: int = 7):
+    """Cuerpo de la petición troceado en partes pequeñas, como llega por la red."""
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def _run(data: bytes, fmt: str, batch_size: int = 2, ordered: bool = True, fail_on=None):
+    stored, batches = [], []
+
+    def write_batch(batch, ordered):
+        # Imita insert_many: en modo ordenado para en el primer error, en no ordenado lo salta
+        batches.append(len(batch))
+        inserted, errors = 0, []
+        for index, document in enumerate(batch):
+            if fail_on and fail_on(document):
+                errors.append(f"Document {index}: duplicate key")
+                if ordered:
+                    break
+                continue
+            stored.append(document)
+            inserted += 1
+        return inserted, errors
+
+    progress = ingest.IngestProgress(database="tienda", collection="productos", format=fmt, ordered=ordered, batch_size=batch_size)
+    documents = ingest.iter_documents(ingest.iter_lines(_chunks(data)), fmt)
+    asyncio.run(ingest.ingest(documents, write_batch, progress))
+    return progress, stored, batches
+
+
+def test_jsonl_is_written_in_batches():
+    data = "\n".join(f'{{"sku": {i}, "nombre": "artículo {i}"}}' for i in range(5)).encode("utf-8")
+    progress, stored, batches = _run(data, ingest.FORMAT_JSONL)
+    assert progress.status == "completed"
+    assert batches == [2, 2, 1]
+    assert [document["sku"] for document in stored] == [0, 1, 2, 3, 4]
+    assert stored[3]["nombre"] == "artículo 3"
+    assert progress.to_dict()["inserted"] == 5
+
+
+def test_csv_with_header_and_quoted_newlines():
+    data = b'sku,nombre,precio,activo\r\n1,"mesa\ngrande",10.5,true\r\n2,silla,,false\r\n'
+    progress, stored, _ = _run(data, ingest.FORMAT_CSV)
+    assert progress.status == "completed"
+    assert stored == [
+        {"sku": 1, "nombre": "mesa\ngrande", "precio": 10.5, "activo": True},
+        {"sku": 2, "nombre": "silla", "activo": False},
+    ]
+
+
+def test_csv_only_converts_clean_decimal_literals():
+    data = b'codigo,cantidad,ratio,exp,neg,raro\r\n007,1_000,NaN,1e3,-0.5, 42\r\n0,12,0.25,Infinity,-3,0x1F\r\n'
+    _, stored, _ = _run(data, ingest.FORMAT_CSV)
+    assert stored == [
+        {"codigo": "007", "cantidad": "1_000", "ratio": "NaN", "exp": 1000.0, "neg": -0.5, "raro": " 42"},
+        {"codigo": 0, "cantidad": 12, "ratio": 0.25, "exp": "Infinity", "neg": -3, "raro": "0x1F"},
+    ]
+
+
+def test_ordered_stops_at_first_error_and_unordered_continues():
+    data = b"\n".join(b'{"sku": %d}' % i for i in range(6))
+    is_bad = lambda document: document["sku"] == 1
+
+    progress, stored, batches = _run(data, ingest.FORMAT_JSONL, ordered=True, fail_on=is_bad)
+    assert progress.status == "failed"
+    assert batches == [2] and progress.inserted == 1 and progress.failed == 1
+
+    progress, stored, batches = _run(data, ingest.FORMAT_JSONL, ordered=False, fail_on=is_bad)
+    assert progress.status == "completed"
+    assert batches == [2, 2, 2] and progress.inserted == 5 and progress.failed == 1
+
+
+def test_invalid_line_fails_with_line_number():
+    progress, stored, _ = _run(b'{"sku": 1}\n{"sku": \n', ingest.FORMAT_JSONL, batch_size=10)
+    assert progress.status == "failed"
+    assert stored == []
+    assert progress.errors[0].startswith("Line 2:")
+
+
+def test_collection_names():
+    assert ingest.is_valid_collection_name("productos")
+    assert ingest.is_valid_collection_name("ventas.2024")
+    for name in ("", "pre$cios", "system.users", "a\0b", ".oculta", "fin."):
+        assert not ingest.is_valid_collection_name(name), name
@@ -0,0 +1,116 @@
+# test_llm_scheduler.py
+# Pruebas del planificador de peticiones al LLM contra el stub local con cuotas
+# (no necesitan red ni API key).
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import llm_scheduler
+from llm_scheduler import PRIORITY_CONTINUATION, PRIORITY_NEW, RateLimited, RateLimitScheduler
+from stub_gemini import StubGeminiServer
+
+
+def _send_to(endpoint: str, prompt: str = "hola"):
+    """Función send() para el planificador: una petición HTTP al stub."""
+    def send():
+        body = json.dumps({"contents": [{"parts": [{"text": prompt}]}]}).encode("utf-8")
+        request = urllib.request.Request(endpoint, data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                result = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code == 429:
+                raise RateLimited(float(e.headers.get("Retry-After", 1)))
+            raise
+        return result, result["usageMetadata"]["totalTokenCount"]
+    return send
+
+
+def test_burst_is_queued_instead_of_failing():
+    # El stub admite 4 peticiones por ventana de 1 s; llegan 10 a la vez
+    server = StubGeminiServer(rpm=4, window=1.0).start()
+    try:
+        scheduler = RateLimitScheduler(requests_per_minute=4, tokens_per_minute=100_000, window=1.0, name="test.burst")
+        results, errors = [], []
+
+        def worker():
+            try:
+                results.append(scheduler.submit(_send_to(server.endpoint()), estimated_tokens=10))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+
+        assert not errors
+        assert len(results) == 10
+        assert server.accepted == 10
+        usage = scheduler.usage()
+        assert usage["queued"] == 0
+        assert usage["requests_per_minute"] == 4
+    finally:
+        server.stop()
+
+
+def test_continuations_go_before_new_requests():
+    scheduler = RateLimitScheduler(requests_per_minute=1, tokens_per_minute=100_000, window=0.2, name="test.priority")
+    scheduler.acquire(1) # Agota el cubo: las siguientes tienen que esperar en cola
+    order = []
+
+    def worker(label, priority):
+        scheduler.acquire(1, priority)
+        order.append(label)
+
+    new = threading.Thread(target=worker, args=("new", PRIORITY_NEW))
+    new.start()
+    while scheduler.usage()["queued"] < 1:
+        pass
+    continuation = threading.Thread(target=worker, args=("continuation", PRIORITY_CONTINUATION))
+    continuation.start()
+    new.join(timeout=5)
+    continuation.join(timeout=5)
+
+    assert order == ["continuation", "new"]
+
+
+def test_concurrency_limit_lets_continuations_go_first():
+    scheduler = RateLimitScheduler(requests_per_minute=100, tokens_per_minute=100_000, name="test.concurrency", max_concurrent=1)
+    release = threading.Event()
+    order = []
+
+    def slow():
+        release.wait(5)
+        return "primera", None
+
+    def worker(label, priority):
+        scheduler.submit(lambda: (order.append(label), None), estimated_tokens=1, priority=priority)
+
+    first = threading.Thread(target=scheduler.submit, args=(slow, 1))
+    first.start()
+    while scheduler.usage()["active"] < 1:
+        pass
+    # El único hueco está ocupado: la petición nueva llega antes, pero la continuación pasa primero
+    new = threading.Thread(target=worker, args=("new", PRIORITY_NEW))
+    new.start()
+    while scheduler.usage()["queued"] < 1:
+        pass
+    continuation = threading.Thread(target=worker, args=("continuation", PRIORITY_CONTINUATION))
+    continuation.start()
+    while scheduler.usage()["queued"] < 2:
+        pass
+    release.set()
+    for thread in (first, new, continuation):
+        thread.join(timeout=5)
+
+    assert order == ["continuation", "new"]
+    assert scheduler.usage()["active"] == 0
+
+
+def test_task_priority_context():
+    with llm_scheduler.task_priority(PRIORITY_CONTINUATION):
+        assert llm_scheduler._current_priority.get() == PRIORITY_CONTINUATION
+    assert llm_scheduler._current_priority.get() == PRIORITY_NEW
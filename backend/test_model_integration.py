@@ -0,0 +1,32 @@
+# test_model_integration.py
+# GeminiLLM contra el stub local de Gemini: en modo JSON la respuesta llega sin tocar
+# a communication.parse_model_output, que repara el JSON con vallas o texto alrededor.
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("langchain")
+
+import communication
+import metrics
+from model_integration import GeminiLLM
+from stub_gemini import StubGeminiServer
+
+COMMAND_JSON = '{"action": "consulta mongo", "command": "show dbs"}'
+
+
+@pytest.mark.parametrize("reply", [
+    f"```json\n{COMMAND_JSON}\n```",
+    f"Aquí tienes la respuesta: {COMMAND_JSON}",
+])
+def test_fenced_or_wrapped_json_is_repaired(reply):
+    server = StubGeminiServer(rpm=1000, reply=lambda *args: reply).start()
+    try:
+        llm = GeminiLLM(api_base=server.base_url, api_key="test", response_mode="json")
+        raw_text = llm._call("hola")
+        assert raw_text == reply
+
+        repaired = metrics.get_counter("llm.output.repaired")
+        assert communication.parse_model_output(raw_text) == ("consulta mongo", "show dbs")
+        assert metrics.get_counter("llm.output.repaired") == repaired + 1
+    finally:
+        server.stop()
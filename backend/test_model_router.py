@@ -0,0 +1,122 @@
+# test_model_router.py
+# Pruebas del enrutado de modelos por tipo de paso contra el stub local de Gemini
+# (no necesitan red ni API key).
+import json
+import os
+import urllib.error
+import urllib.request
+from unittest import mock
+
+import llm_scheduler
+import model_router
+from model_router import STEP_FINAL, STEP_RETRY, STEP_TOOL, ModelRouter, Outcome, Route
+from stub_gemini import StubGeminiServer
+
+ROUTES = {
+    STEP_TOOL: Route(STEP_TOOL, "fast-model", 256, 0.0),
+    STEP_FINAL: Route(STEP_FINAL, "fast-model", 1024, 0.3),
+    STEP_RETRY: Route(STEP_RETRY, "strong-model", 1024, 0.0),
+}
+
+
+def _send_for(server: StubGeminiServer):
+    """Backend mínimo para el router: una llamada a generateContent del stub con los parámetros de la ruta."""
+    def send(route: Route) -> Outcome:
+        body = json.dumps({
+            "contents": [{"parts": [{"text": "hola"}]}],
+            "generationConfig": {"maxOutputTokens": route.max_output_tokens, "temperature": route.temperature},
+        }).encode("utf-8")
+        request = urllib.request.Request(server.endpoint(route.model), data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            candidate = json.loads(response.read())["candidates"][0]
+        return Outcome(text=candidate["content"]["parts"][0]["text"], finish_reason=candidate["finishReason"])
+    return send
+
+
+def test_tool_step_uses_fast_model():
+    server = StubGeminiServer(rpm=1000).start()
+    try:
+        router = ModelRouter(routes=ROUTES)
+        with model_router.step_type(STEP_TOOL):
+            router.call(_send_for(server))
+        assert server.calls_by_model == {"fast-model": 1}
+        assert router.stats()[STEP_TOOL]["success_rate"] == 1.0
+    finally:
+        server.stop()
+
+
+def test_truncated_output_escalates_to_final_route():
+    def reply(prompt, generation_config, model):
+        if generation_config["maxOutputTokens"] < 1024:
+            return "respuesta usuario: Encontré", "MAX_TOKENS"
+        return "respuesta usuario: Encontré 5 artículos."
+
+    server = StubGeminiServer(rpm=1000, reply=reply).start()
+    try:
+        router = ModelRouter(routes=ROUTES)
+        text = router.call(_send_for(server), step=STEP_TOOL)
+        assert text == "respuesta usuario: Encontré 5 artículos."
+        stats = router.stats()
+        assert stats[STEP_TOOL]["escalated"] == 1
+        assert stats[STEP_FINAL]["calls"] == 1
+    finally:
+        server.stop()
+
+
+def test_failed_call_escalates_to_retry_model():
+    def reply(prompt, generation_config, model):
+        if model == "fast-model":
+            raise RuntimeError("overloaded")
+        return "consulta mongo: show dbs"
+
+    server = StubGeminiServer(rpm=1000, reply=reply).start()
+    try:
+        router = ModelRouter(routes=ROUTES)
+        assert router.call(_send_for(server), step=STEP_TOOL) == "consulta mongo: show dbs"
+        assert server.calls_by_model == {"fast-model": 1, "strong-model": 1}
+        stats = router.stats()
+        assert stats[STEP_TOOL]["success_rate"] == 0.0
+        assert stats[STEP_RETRY]["success_rate"] == 1.0
+    finally:
+        server.stop()
+
+
+def test_client_errors_and_exhausted_rate_limits_do_not_escalate():
+    bad_request = urllib.error.HTTPError("http://stub", 400, "Bad Request", {}, None)
+    tool = ROUTES[STEP_TOOL]
+    assert model_router.escalate_failed_call(tool, Outcome(error=bad_request)) is None
+    assert model_router.escalate_failed_call(tool, Outcome(error=llm_scheduler.RateLimited(1.0))) is None
+    server_error = urllib.error.HTTPError("http://stub", 503, "Unavailable", {}, None)
+    assert model_router.escalate_failed_call(tool, Outcome(error=server_error)) == STEP_RETRY
+
+    calls = []
+
+    def send(route):
+        calls.append(route.name)
+        raise llm_scheduler.RateLimited(1.0)
+
+    try:
+        ModelRouter(routes=ROUTES).call(send, step=STEP_TOOL)
+        assert False, "expected RateLimited"
+    except llm_scheduler.RateLimited:
+        pass
+    assert calls == [STEP_TOOL]
+
+
+def test_default_tool_route_keeps_512_tokens():
+    environ = {name: value for name, value in os.environ.items() if name != "GEMINI_TOOL_MAX_TOKENS"}
+    with mock.patch.dict(os.environ, environ, clear=True):
+        assert model_router.default_routes()[STEP_TOOL].max_output_tokens == 512
+
+
+def test_retry_route_failure_is_raised():
+    server = StubGeminiServer(rpm=1000, reply=lambda *args: (_ for _ in ()).throw(RuntimeError("down"))).start()
+    try:
+        router = ModelRouter(routes=ROUTES)
+        try:
+            router.call(_send_for(server), step=STEP_RETRY)
+            assert False, "expected an HTTP error"
+        except urllib.error.HTTPError as e:
+            assert e.code == 500
+    finally:
+        server.stop()
@@ -0,0 +1,48 @@
+# test_profiling.py
+# Pruebas del perfilado bajo demanda (muestreo con pilas colapsadas y cProfile).
+import pstats
+import tempfile
+import time
+
+import profiling
+
+
+def _busy_agent_step():
+    deadline = time.perf_counter() + 0.1
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+    return "completed"
+
+
+def test_sampling_profile_writes_collapsed_stacks():
+    directory = tempfile.mkdtemp()
+    result, path = profiling.run_profiled(_busy_agent_step, "chat-abc/1", "sampling", directory)
+    assert result == "completed"
+    assert path.endswith(".folded") and "chat-abc_1-" in path
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert any("_busy_agent_step (test_profiling.py" in line for line in lines)
+
+
+def test_cprofile_profile_is_readable_by_pstats():
+    result, path = profiling.run_profiled(_busy_agent_step, "cli", "cprofile", tempfile.mkdtemp())
+    assert result == "completed"
+    stats = pstats.Stats(path)
+    assert any(name == "_busy_agent_step" for _, _, name in stats.stats)
+
+
+def test_concurrent_cprofile_runs_are_rejected_not_crashed():
+    def nested():
+        try:
+            profiling.run_profiled(_busy_agent_step, "inner", "cprofile", tempfile.mkdtemp())
+        except profiling.ProfilerBusy:
+            return "busy"
+        return "ran"
+
+    result, _ = profiling.run_profiled(nested, "outer", "cprofile", tempfile.mkdtemp())
+    assert result == "busy"
+    # Al terminar se libera: el siguiente perfil funciona
+    assert profiling.run_profiled(_busy_agent_step, "again", "cprofile", tempfile.mkdtemp())[0] == "completed"
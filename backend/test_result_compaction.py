@@ -0,0 +1,56 @@
+# test_result_compaction.py
+# Pruebas de la compactación de resultados de mongosh para el prompt.
+import result_compaction
+from result_compaction import compact_result
+
+FIND_OUTPUT = """[
+  {
+    _id: ObjectId('6630f1a2b4c5d6e7f8a9b0c1'),
+    nombre: 'Mesa, roble',
+    precio: 120.5,
+    tags: [ 'salon', 'madera' ],
+    medidas: { ancho: 80, alto: 75 }
+  },
+  {
+    _id: ObjectId('6630f1a2b4c5d6e7f8a9b0c2'),
+    nombre: 'Silla',
+    precio: -3,
+    tags: [],
+    medidas: { ancho: 40, alto: 90 },
+    creado: ISODate('2024-05-01T10:00:00.000Z')
+  }
+]
+Type "it" for more"""
+
+
+def test_homogeneous_documents_become_a_table():
+    compacted = compact_result(FIND_OUTPUT)
+    assert compacted.splitlines() == [
+        "2 documentos (tabla, un documento por fila): _id | nombre | precio | tags | medidas.ancho | medidas.alto | creado",
+        "ObjectId('6630f1a2b4c5d6e7f8a9b0c1') | 'Mesa, roble' | 120.5 | ['salon','madera'] | 80 | 75 | ",
+        "ObjectId('6630f1a2b4c5d6e7f8a9b0c2') | 'Silla' | -3 | [] | 40 | 90 | ISODate('2024-05-01T10:00:00.000Z')",
+        'Type "it" for more',
+    ]
+    assert len(compacted) < len(FIND_OUTPUT)
+
+
+def test_other_outputs_are_left_untouched():
+    heterogeneous = "[ { a: 1 }, { b: 2 }, { c: 3 } ]"
+    for output in ("5", "switched to db tienda", "[ { a: 1 } ]", heterogeneous, "[ 1, 2, 3 ]", "[ { a: 1 "):
+        assert compact_result(output) == output
+
+
+def test_can_be_switched_off():
+    result_compaction.ENABLED = False
+    try:
+        assert compact_result(FIND_OUTPUT) == FIND_OUTPUT
+    finally:
+        result_compaction.ENABLED = True
+
+
+def test_stats_track_token_savings():
+    before = result_compaction.compaction_stats()
+    compact_result(FIND_OUTPUT)
+    after = result_compaction.compaction_stats()
+    assert after["compacted"] == before["compacted"] + 1
+    assert after["tokens_before"] - before["tokens_before"] > after["tokens_after"] - before["tokens_after"]
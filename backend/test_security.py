@@ -0,0 +1,97 @@
+# test_security.py
+# Pruebas del clasificador de comandos (no necesitan mongosh).
+import security
+from security import DESTRUCTIVE, READ, WRITE
+
+# Comandos inofensivos que la detección por subcadenas marcaba como peligrosos
+FALSE_POSITIVES = [
+    "db.orders.find({ deleted: false })",
+    "db.removals.find()",
+    "db.users.find({ status: 'killed' })",
+    "db.logs.find({ message: /drop table/i })",
+    "db.getCollection('dropped_items').countDocuments({})",
+    "db.shutdown_events.aggregate([{ $match: { type: 'remove' } }])",
+    "db.tasks.find({ 'delete': true }).sort({ killedAt: -1 })",
+    "print('drop everything')",
+    "show dbs",
+    "use drops",
+]
+
+READS = [
+    "db.getCollectionNames()",
+    "db.inventario.find({ price: { $lt: 50 } })",
+    "db.runCommand({ ping: 1 })",
+    "db.adminCommand({ listDatabases: 1 })",
+    "db.ventas.aggregate([{ $group: { _id: '$region', total: { $sum: 1 } } }])",
+    "db.pedidos.find().toArray()[i].total", # Clave calculada sin llamada
+]
+
+WRITES = [
+    "db.test_collection.insertMany([{ name: 'Alice' }, { name: 'Bob' }])",
+    "db.users.updateOne({ name: 'Alice' }, { $set: { age: 31 } })",
+    "db.runCommand({ insert: 'users', documents: [{ a: 1 }] })",
+    "db.users.findAndModify({ query: { a: 1 }, update: { $set: { b: 2 } }, remove: false })",
+    "db.ventas.aggregate([{ $match: {} }, { $merge: { into: 'resumen' } }])",
+    "db.createCollection('nueva')",
+]
+
+DESTRUCTIVES = [
+    "db.logs_viejos.drop()",
+    "db.dropDatabase()",
+    "db.users.deleteMany({})",
+    "db.users.remove({ age: { $lt: 18 } })",
+    "db.getCollection('logs').drop()",
+    "db.logs['drop']()",
+    "db.runCommand({ drop: 'logs' })",
+    "db.runCommand({ \"delete\": 'users', deletes: [{ q: {}, limit: 0 }] })",
+    "db.adminCommand({ shutdown: 1 })",
+    "db.adminCommand('shutdown')",
+    "db.killOp(12345)",
+    "db.ventas.aggregate([{ $match: {} }, { $out: 'ventas' }])",
+    "db.users.bulkWrite([{ insertOne: { document: {} } }, { deleteMany: { filter: {} } }])",
+    "db.getCollectionNames().forEach(c => db[c].drop())",
+    # findAndModify que borra, métodos referenciados sin llamarlos y runCommand sin literal
+    "db.users.findAndModify({ query: {}, remove: true })",
+    "db.runCommand({ findAndModify: 'users', remove: true })",
+    "db.logs.drop.call(db.logs)",
+    "db.logs['drop'].apply(db.logs)",
+    "var c = { drop: 'logs' }; db.runCommand(c)",
+    "db.adminCommand({ [verb]: 1 })",
+    # Llamadas con clave calculada: el método no se conoce estáticamente
+    "var m = 'drop'; db.logs[m]()",
+    "const m='deleteMany'; db.users[m]({})",
+    "db.logs['dr'+'op']()",
+    "db.logs[`${'dr'}op`]()",
+    "db.logs[m].call(db.logs)",
+]
+
+
+def test_false_positives_are_reads():
+    for command in FALSE_POSITIVES:
+        assert security.classify_command(command) == READ, command
+        assert not security.is_command_dangerous(command), command
+
+
+def test_reads():
+    for command in READS:
+        assert security.classify_command(command) == READ, command
+
+
+def test_writes_are_not_dangerous():
+    for command in WRITES:
+        assert security.classify_command(command) == WRITE, command
+        assert not security.is_command_dangerous(command), command
+
+
+def test_destructive_commands_are_dangerous():
+    for command in DESTRUCTIVES:
+        assert security.classify_command(command) == DESTRUCTIVE, command
+        assert security.is_command_dangerous(command), command
+
+
+def test_inspect_command_reports_verbs_and_stages():
+    info = security.inspect_command("db.runCommand({ drop: 'logs' })")
+    assert info.command_verbs == ["drop"]
+    info = security.inspect_command("db.v.aggregate([{ $out: 'x' }])")
+    assert info.methods == ["aggregate"]
+    assert info.stages == ["$out"]